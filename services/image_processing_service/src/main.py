@@ -4,22 +4,62 @@ Procesamiento directo y eficiente de paquetes de imágenes
 """
 
 import os
-import json
 import zipfile
 import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import repeat
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, BinaryIO
 from flask import Flask, request, jsonify
+import google.auth
+from google.api_core.exceptions import NotFound
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
+from google.oauth2 import service_account
+from requests.adapters import HTTPAdapter
+
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson es opcional; sin él se usa el parser estándar
+    from json import loads as json_loads
 
 app = Flask(__name__)
 
-# Cliente de Google Cloud Storage
-storage_client = storage.Client()
+# Cliente de Google Cloud Storage (se crea en el primer uso, no al importar)
+@lru_cache(maxsize=None)
+def get_storage_client() -> storage.Client:
+    """Retorna el cliente de GCS compartido por todo el proceso"""
+    credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    # Pool dimensionado para las descargas en paralelo de todos los hilos de gunicorn
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GUNICORN_THREADS * MAX_DOWNLOAD_WORKERS)
+    session.mount('https://', adapter)
+    return storage.Client(project=project, credentials=credentials, _http=session)
+
+@lru_cache(maxsize=64)
+def get_bucket(bucket_name: str) -> storage.Bucket:
+    """Retorna la referencia (sin llamada de red) al bucket, reutilizada entre requests"""
+    return get_storage_client().bucket(bucket_name)
+
+# Credenciales para firmar URLs localmente, sin una llamada a IAM signBlob por URL
+@lru_cache(maxsize=None)
+def get_signing_credentials() -> Optional[service_account.Credentials]:
+    """Carga una sola vez la clave de la cuenta de servicio (None si no está configurada)"""
+    key_path = os.environ.get('SIGNING_SA_KEY_PATH')
+    if not key_path:
+        return None
+    return service_account.Credentials.from_service_account_file(key_path)
 
 # Configuración
 TEMP_BASE = "/tmp/shipments_processing"
 PROCESSED_BUCKET = "shipments-processed"  # Corregido el nombre del bucket
+MAX_DOWNLOAD_WORKERS = int(os.environ.get('MAX_DOWNLOAD_WORKERS', '8'))
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', '8'))
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.zip', '.gz')
+ZIP_SPOOL_MAX_BYTES = int(os.environ.get('ZIP_SPOOL_MAX_BYTES', str(256 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # múltiplo de 256 KiB, como exige GCS
 os.makedirs(TEMP_BASE, exist_ok=True)
 
 @app.route('/health', methods=['GET'])
@@ -73,18 +113,18 @@ def process_package():
         
         print(f"✅ Descargadas {len(downloaded_files)} imágenes")
         
-        # 4. Crear ZIP
+        # 4. Crear ZIP en memoria (solo pasa a disco si supera ZIP_SPOOL_MAX_BYTES)
         zip_filename = f"{package_name}.zip"
-        zip_path = os.path.join(temp_dir, zip_filename)
-        create_zip(downloaded_files, zip_path)
-        
-        # Obtener tamaño del ZIP
-        zip_size_mb = os.path.getsize(zip_path) / (1024 * 1024)
-        print(f"📦 ZIP creado: {zip_size_mb:.2f} MB")
-        
-        # 5. Subir ZIP a bucket de procesados
-        blob_path = f"{processing_uuid}/{zip_filename}"
-        upload_to_gcs(zip_path, PROCESSED_BUCKET, blob_path)
+        with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_BYTES, dir=temp_dir) as zip_file:
+            create_zip(downloaded_files, zip_file)
+            
+            # Obtener tamaño del ZIP (el buffer queda posicionado al final)
+            zip_size_mb = zip_file.tell() / (1024 * 1024)
+            print(f"📦 ZIP creado: {zip_size_mb:.2f} MB")
+            
+            # 5. Subir ZIP a bucket de procesados
+            blob_path = f"{processing_uuid}/{zip_filename}"
+            upload_to_gcs(zip_file, PROCESSED_BUCKET, blob_path)
         
         # 6. Generar URL firmada (2 horas de expiración)
         signed_url = generate_signed_url(PROCESSED_BUCKET, blob_path, hours=2)
@@ -136,15 +176,17 @@ def get_processing_status(processing_uuid: str):
     """
     try:
         # Verificar si existe algún archivo para este UUID
-        bucket = storage_client.bucket(PROCESSED_BUCKET)
-        blobs = list(bucket.list_blobs(prefix=f"{processing_uuid}/"))
+        bucket = get_bucket(PROCESSED_BUCKET)
+        # Solo se necesitan los nombres: se pide a GCS únicamente ese campo
+        blobs = bucket.list_blobs(prefix=f"{processing_uuid}/", fields='items(name),nextPageToken')
+        files = [blob.name for blob in blobs]
         
-        if blobs:
+        if files:
             return {
                 'processing_uuid': processing_uuid,
                 'status': 'completed',
-                'files_found': len(blobs),
-                'files': [blob.name for blob in blobs]
+                'files_found': len(files),
+                'files': files
             }, 200
         else:
             return {
@@ -169,14 +211,15 @@ def read_package_from_gcs(package_uri: str) -> Optional[Dict]:
             return None
         
         bucket_name, blob_path = parts
-        bucket = storage_client.bucket(bucket_name)
+        bucket = get_bucket(bucket_name)
         blob = bucket.blob(blob_path)
         
-        if not blob.exists():
+        # Sin exists() previo: un blob inexistente responde NotFound en la descarga
+        try:
+            content = blob.download_as_bytes()
+        except NotFound:
             return None
-        
-        content = blob.download_as_text()
-        return json.loads(content)
+        return json_loads(content)
         
     except Exception as e:
         print(f"Error leyendo paquete: {e}")
@@ -194,64 +237,82 @@ def extract_image_paths(package_data: Dict) -> List[str]:
     return image_paths
 
 def download_images(image_paths: List[str], temp_dir: str) -> List[str]:
-    """Descarga las imágenes a un directorio temporal"""
-    downloaded = []
+    """Descarga las imágenes en paralelo a un directorio temporal"""
+    if not image_paths:
+        return []
     
-    for i, image_path in enumerate(image_paths):
+    # Las descargas son I/O puro: se solapan las latencias de GCS entre hilos
+    max_workers = min(MAX_DOWNLOAD_WORKERS, len(image_paths))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            download_image, range(len(image_paths)), image_paths, repeat(temp_dir)
+        )
+        # map conserva el orden original de las imágenes
+        return [local_path for local_path in results if local_path]
+
+def download_image(index: int, image_path: str, temp_dir: str) -> Optional[str]:
+    """Descarga una imagen y retorna su ruta local (None si no se pudo)"""
+    try:
+        # Manejar diferentes formatos de rutas
+        if image_path.startswith("gs://"):
+            uri = image_path
+        else:
+            # Si no tiene gs://, asumir que está en shipments-images
+            filename = os.path.basename(image_path)
+            uri = f"gs://shipments-images/{filename}"
+        
+        # Parsear URI
+        parts = uri[5:].split("/", 1)
+        if len(parts) != 2:
+            return None
+        
+        bucket_name, blob_path = parts
+        
+        bucket = get_bucket(bucket_name)
+        local_filename = f"img_{index:04d}_{os.path.basename(blob_path)}"
+        local_path = os.path.join(temp_dir, local_filename)
+        
+        # Descargar directamente: la existencia se detecta por NotFound, sin exists() previo
         try:
-            # Manejar diferentes formatos de rutas
-            if image_path.startswith("gs://"):
-                uri = image_path
-            else:
-                # Si no tiene gs://, asumir que está en shipments-images
-                filename = os.path.basename(image_path)
-                uri = f"gs://shipments-images/{filename}"
-            
-            # Parsear URI
-            parts = uri[5:].split("/", 1)
-            if len(parts) != 2:
-                continue
-            
-            bucket_name, blob_path = parts
-            
-            # Descargar
-            bucket = storage_client.bucket(bucket_name)
-            blob = bucket.blob(blob_path)
-            
-            if not blob.exists():
-                # Intentar con .png si no existe
-                if not blob_path.endswith('.png'):
-                    blob = bucket.blob(blob_path + '.png')
-                    if not blob.exists():
-                        print(f"⚠️ Imagen no encontrada: {blob_path}")
-                        continue
-            
-            # Guardar localmente
-            local_filename = f"img_{i:04d}_{os.path.basename(blob_path)}"
-            local_path = os.path.join(temp_dir, local_filename)
-            blob.download_to_filename(local_path)
-            downloaded.append(local_path)
-            
-        except Exception as e:
-            print(f"Error descargando imagen {image_path}: {e}")
-            continue
-    
-    return downloaded
+            bucket.blob(blob_path).download_to_filename(local_path)
+        except NotFound:
+            # Intentar con .png si no existe
+            if blob_path.endswith('.png'):
+                raise
+            try:
+                bucket.blob(blob_path + '.png').download_to_filename(local_path)
+            except NotFound:
+                print(f"⚠️ Imagen no encontrada: {blob_path}")
+                return None
+        return local_path
+        
+    except Exception as e:
+        print(f"Error descargando imagen {image_path}: {e}")
+        return None
 
-def create_zip(files: List[str], zip_path: str):
-    """Crea un archivo ZIP con las imágenes"""
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+def create_zip(files: List[str], zip_file: BinaryIO):
+    """Escribe en zip_file un ZIP con las imágenes"""
+    with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
         for file_path in files:
             if os.path.exists(file_path):
                 arcname = os.path.basename(file_path)
-                zipf.write(file_path, arcname)
+                # Las imágenes ya vienen comprimidas: se guardan sin deflate
+                if arcname.lower().endswith(STORED_EXTENSIONS):
+                    zipf.write(file_path, arcname, compress_type=zipfile.ZIP_STORED)
+                else:
+                    zipf.write(file_path, arcname)
 
-def upload_to_gcs(local_path: str, bucket_name: str, blob_path: str):
-    """Sube un archivo a GCS"""
+def upload_to_gcs(file_obj: BinaryIO, bucket_name: str, blob_path: str):
+    """Sube a GCS el contenido de un archivo abierto"""
     try:
-        bucket = storage_client.bucket(bucket_name)
+        bucket = get_bucket(bucket_name)
         blob = bucket.blob(blob_path)
-        blob.upload_from_filename(local_path)
+        size = file_obj.seek(0, os.SEEK_END)
+        file_obj.seek(0)
+        # ZIPs grandes: subida resumible en bloques; los pequeños van en una sola petición
+        if size > UPLOAD_CHUNK_SIZE:
+            blob.chunk_size = UPLOAD_CHUNK_SIZE
+        blob.upload_from_file(file_obj, size=size, content_type='application/zip')
         print(f"✅ Archivo subido a gs://{bucket_name}/{blob_path}")
     except Exception as e:
         raise Exception(f"Error subiendo archivo: {str(e)}")
@@ -259,13 +320,14 @@ def upload_to_gcs(local_path: str, bucket_name: str, blob_path: str):
 def generate_signed_url(bucket_name: str, blob_path: str, hours: int = 2) -> str:
     """Genera una URL firmada para descarga"""
     try:
-        bucket = storage_client.bucket(bucket_name)
+        bucket = get_bucket(bucket_name)
         blob = bucket.blob(blob_path)
         
         url = blob.generate_signed_url(
             version="v4",
             expiration=timedelta(hours=hours),
-            method="GET"
+            method="GET",
+            credentials=get_signing_credentials()
         )
         
         return url
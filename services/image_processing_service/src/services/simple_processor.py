@@ -4,13 +4,24 @@ Procesamiento directo y eficiente de paquetes de imágenes
 """
 
 import os
-import json
 import zipfile
 import tempfile
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, BinaryIO
+import google.auth
+from google.api_core.exceptions import NotFound
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
+from google.oauth2 import service_account
+from requests.adapters import HTTPAdapter
+
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson es opcional; sin él se usa el parser estándar
+    from json import loads as json_loads
 
 class SimpleProcessor:
     """
@@ -22,11 +33,38 @@ class SimpleProcessor:
     5. Retorna el resultado
     """
     
+    # Formatos ya comprimidos: deflate solo gasta CPU sin reducir tamaño
+    STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.zip', '.gz')
+    # ZIPs menores a este tamaño se construyen en memoria
+    ZIP_SPOOL_MAX_BYTES = 256 * 1024 * 1024
+    # Tamaño de bloque para subidas resumibles (múltiplo de 256 KiB)
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+    
     def __init__(self):
-        self.storage_client = storage.Client()
         self.temp_base = "/tmp/shipments_processing"
+        self.max_download_workers = int(os.environ.get('MAX_DOWNLOAD_WORKERS', '8'))
+        gunicorn_threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+        credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+        session = AuthorizedSession(credentials)
+        # Pool dimensionado para las descargas en paralelo de todos los hilos de gunicorn
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=gunicorn_threads * self.max_download_workers)
+        session.mount('https://', adapter)
+        self.storage_client = storage.Client(project=project, credentials=credentials, _http=session)
+        self._buckets: Dict[str, storage.Bucket] = {}
+        # Clave de la cuenta de servicio para firmar URLs sin llamar a IAM signBlob
+        key_path = os.environ.get('SIGNING_SA_KEY_PATH')
+        self.signing_credentials = (
+            service_account.Credentials.from_service_account_file(key_path) if key_path else None
+        )
         os.makedirs(self.temp_base, exist_ok=True)
     
+    def _bucket(self, bucket_name: str) -> storage.Bucket:
+        """Retorna la referencia al bucket, cacheada por nombre"""
+        bucket = self._buckets.get(bucket_name)
+        if bucket is None:
+            bucket = self._buckets[bucket_name] = self.storage_client.bucket(bucket_name)
+        return bucket
+    
     def process_package(self, processing_uuid: str, package_uri: str, 
                        package_name: str) -> Dict[str, Any]:
         """
@@ -53,14 +91,14 @@ class SimpleProcessor:
             if not downloaded_files:
                 raise ValueError("No se pudieron descargar imágenes")
             
-            # 5. Crear ZIP
-            zip_path = os.path.join(temp_dir, f"{package_name}.zip")
-            self._create_zip(downloaded_files, zip_path)
-            
-            # 6. Subir ZIP a bucket de procesados
+            # 5. Crear ZIP en memoria (solo pasa a disco si es muy grande)
             bucket_name = "shipments-images-processed"
             blob_path = f"{processing_uuid}/{package_name}.zip"
-            uploaded_url = self._upload_to_gcs(zip_path, bucket_name, blob_path)
+            with tempfile.SpooledTemporaryFile(max_size=self.ZIP_SPOOL_MAX_BYTES, dir=temp_dir) as zip_file:
+                self._create_zip(downloaded_files, zip_file)
+                
+                # 6. Subir ZIP a bucket de procesados
+                uploaded_url = self._upload_to_gcs(zip_file, bucket_name, blob_path)
             
             # 7. Generar URL firmada (2 horas de expiración)
             signed_url = self._generate_signed_url(bucket_name, blob_path, hours=2)
@@ -112,14 +150,15 @@ class SimpleProcessor:
             
             bucket_name, blob_path = parts
             
-            bucket = self.storage_client.bucket(bucket_name)
+            bucket = self._bucket(bucket_name)
             blob = bucket.blob(blob_path)
             
-            if not blob.exists():
+            # Sin exists() previo: un blob inexistente responde NotFound en la descarga
+            try:
+                content = blob.download_as_bytes()
+            except NotFound:
                 return None
-            
-            content = blob.download_as_text()
-            return json.loads(content)
+            return json_loads(content)
             
         except Exception:
             return None
@@ -136,67 +175,82 @@ class SimpleProcessor:
         return image_paths
     
     def _download_images(self, image_paths: List[str], temp_dir: str) -> List[str]:
-        """Descarga las imágenes a un directorio temporal"""
-        downloaded = []
+        """Descarga las imágenes en paralelo a un directorio temporal"""
+        if not image_paths:
+            return []
         
-        for i, image_path in enumerate(image_paths):
+        # Las descargas son I/O puro: se solapan las latencias de GCS entre hilos
+        max_workers = min(self.max_download_workers, len(image_paths))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                self._download_image, range(len(image_paths)), image_paths, repeat(temp_dir)
+            )
+            # map conserva el orden original de las imágenes
+            return [local_path for local_path in results if local_path]
+    
+    def _download_image(self, index: int, image_path: str, temp_dir: str) -> Optional[str]:
+        """Descarga una imagen y retorna su ruta local (None si no se pudo)"""
+        try:
+            # Si la ruta ya incluye gs://, usarla directamente
+            # Si no, asumir que está en shipments-images
+            if image_path.startswith("gs://"):
+                uri = image_path
+            else:
+                # Extraer solo el nombre del archivo
+                filename = os.path.basename(image_path)
+                uri = f"gs://shipments-images/{filename}"
+            
+            # Parsear URI
+            parts = uri[5:].split("/", 1)
+            if len(parts) != 2:
+                return None
+            
+            bucket_name, blob_path = parts
+            
+            bucket = self._bucket(bucket_name)
+            local_path = os.path.join(temp_dir, f"image_{index:04d}_{os.path.basename(blob_path)}")
+            
+            # Descargar directamente: la existencia se detecta por NotFound, sin exists() previo
             try:
-                # Si la ruta ya incluye gs://, usarla directamente
-                # Si no, asumir que está en shipments-images
-                if image_path.startswith("gs://"):
-                    uri = image_path
-                else:
-                    # Extraer solo el nombre del archivo
-                    filename = os.path.basename(image_path)
-                    uri = f"gs://shipments-images/{filename}"
-                
-                # Parsear URI
-                parts = uri[5:].split("/", 1)
-                if len(parts) != 2:
-                    continue
-                
-                bucket_name, blob_path = parts
-                
-                # Descargar
-                bucket = self.storage_client.bucket(bucket_name)
-                blob = bucket.blob(blob_path)
-                
-                if not blob.exists():
-                    # Intentar con .png si no existe
-                    if not blob_path.endswith('.png'):
-                        blob = bucket.blob(blob_path + '.png')
-                        if not blob.exists():
-                            continue
-                
-                # Guardar localmente
-                local_path = os.path.join(temp_dir, f"image_{i:04d}_{os.path.basename(blob_path)}")
-                blob.download_to_filename(local_path)
-                downloaded.append(local_path)
-                
-            except Exception:
-                continue
-        
-        return downloaded
+                bucket.blob(blob_path).download_to_filename(local_path)
+            except NotFound:
+                # Intentar con .png si no existe
+                if blob_path.endswith('.png'):
+                    return None
+                bucket.blob(blob_path + '.png').download_to_filename(local_path)
+            return local_path
+            
+        except Exception:
+            return None
     
-    def _create_zip(self, files: List[str], zip_path: str):
+    def _create_zip(self, files: List[str], zip_file: BinaryIO):
         """Crea un archivo ZIP con las imágenes"""
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
             for file_path in files:
                 if os.path.exists(file_path):
                     arcname = os.path.basename(file_path)
-                    zipf.write(file_path, arcname)
+                    # Las imágenes ya vienen comprimidas: se guardan sin deflate
+                    if arcname.lower().endswith(self.STORED_EXTENSIONS):
+                        zipf.write(file_path, arcname, compress_type=zipfile.ZIP_STORED)
+                    else:
+                        zipf.write(file_path, arcname)
     
-    def _upload_to_gcs(self, local_path: str, bucket_name: str, blob_path: str) -> str:
+    def _upload_to_gcs(self, file_obj: BinaryIO, bucket_name: str, blob_path: str) -> str:
         """Sube un archivo a GCS"""
         try:
             # Crear bucket si no existe
             try:
                 bucket = self.storage_client.create_bucket(bucket_name)
             except:
-                bucket = self.storage_client.bucket(bucket_name)
+                bucket = self._bucket(bucket_name)
             
             blob = bucket.blob(blob_path)
-            blob.upload_from_filename(local_path)
+            size = file_obj.seek(0, os.SEEK_END)
+            file_obj.seek(0)
+            # ZIPs grandes: subida resumible en bloques; los pequeños van en una sola petición
+            if size > self.UPLOAD_CHUNK_SIZE:
+                blob.chunk_size = self.UPLOAD_CHUNK_SIZE
+            blob.upload_from_file(file_obj, size=size, content_type='application/zip')
             
             return f"gs://{bucket_name}/{blob_path}"
         except Exception as e:
@@ -205,13 +259,14 @@ class SimpleProcessor:
     def _generate_signed_url(self, bucket_name: str, blob_path: str, hours: int = 2) -> str:
         """Genera una URL firmada para descarga"""
         try:
-            bucket = self.storage_client.bucket(bucket_name)
+            bucket = self._bucket(bucket_name)
             blob = bucket.blob(blob_path)
             
             url = blob.generate_signed_url(
                 version="v4",
                 expiration=timedelta(hours=hours),
-                method="GET"
+                method="GET",
+                credentials=self.signing_credentials
             )
             
             return url
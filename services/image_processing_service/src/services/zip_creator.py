@@ -190,8 +190,7 @@ class ZipCreator:
             # Subir archivo
             blob.upload_from_filename(local_zip_path)
             
-            # Verificar subida
-            blob.reload()
+            # Verificar subida (la respuesta del upload ya trae el tamaño, sin reload)
             gcs_size = blob.size
             
             if gcs_size != zip_result['zip_size_bytes']:
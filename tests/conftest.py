@@ -74,17 +74,6 @@ def temp_directory():
     yield temp_dir
     shutil.rmtree(temp_dir)
 
-@pytest.fixture
-def mock_gcs_client():
-    """Mock Google Cloud Storage client."""
-    with patch('google.cloud.storage.Client') as mock_client:
-        mock_bucket = Mock()
-        mock_blob = Mock()
-        mock_blob.generate_signed_url.return_value = "https://signed-url.example.com"
-        mock_bucket.blob.return_value = mock_blob
-        mock_client.return_value.bucket.return_value = mock_bucket
-        yield mock_client
-
 @pytest.fixture
 def mock_pubsub_client():
     """Mock Google Cloud Pub/Sub client."""
@@ -133,11 +122,20 @@ def setup_test_environment(monkeypatch, test_config):
     for key, value in test_config.items():
         monkeypatch.setenv(key, value)
 
-# Event loop fixture for async tests
+# Event loop fixtures for async tests
+@pytest.fixture(scope="session")
+def event_loop_policy():
+    """Use uvloop's faster event loop when it is installed, the default one otherwise."""
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.DefaultEventLoopPolicy()
+    return uvloop.EventLoopPolicy()
+
 @pytest.fixture(scope="session")
-def event_loop():
-    """Create an instance of the default event loop for the test session."""
-    loop = asyncio.new_event_loop()
+def event_loop(event_loop_policy):
+    """Create an event loop from the selected policy for the test session."""
+    loop = event_loop_policy.new_event_loop()
     yield loop
     loop.close()
 
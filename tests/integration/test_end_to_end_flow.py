@@ -4,23 +4,100 @@ Tests the complete flow from JSON upload to email with signed URLs.
 """
 import pytest
 import json
-import uuid
 import asyncio
+import itertools
 import tempfile
 import os
 from unittest.mock import Mock, patch, MagicMock, call
 from datetime import datetime, timedelta
+from types import MappingProxyType, SimpleNamespace
 from typing import Dict, Any, List
+from urllib.parse import urlsplit
 import requests
 import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fixed reference time: fixture data must be identical across xdist workers
+_NOW = datetime(2024, 1, 1)
+
+# Deterministic sequence for generated test file names
+_seq = itertools.count()
+
+# Service endpoints called through the mocked requests.post
+DIVISION_SERVICE_URL = 'http://division-service/process-file'
+IMAGE_PROCESSING_SERVICE_URL = 'http://image-processing-service/process-package'
+EMAIL_SERVICE_URL = 'http://email-service/send-completion-email'
+
+# Canned responses from every service in the flow (read-only, shared by all tests)
+_MOCK_RESPONSES = MappingProxyType({
+    'division_service': MappingProxyType({
+        'processing_uuid': 'e2e-test-uuid-123',
+        'packages_created': 2,
+        'total_shipments': 2,
+        'status': 'completed',
+        'packages': [
+            {
+                'package_name': 'package_e2e_001.json',
+                'package_uri': 'gs://json-a-procesar/package_e2e_001.json',
+                'shipments': ['E2E_SHIP_001']
+            },
+            {
+                'package_name': 'package_e2e_002.json', 
+                'package_uri': 'gs://json-a-procesar/package_e2e_002.json',
+                'shipments': ['E2E_SHIP_002']
+            }
+        ]
+    }),
+    'image_processing_service': MappingProxyType({
+        'package_1': {
+            'processing_uuid': 'e2e-test-uuid-123',
+            'package_name': 'package_e2e_001.json',
+            'images_processed': 3,
+            'zip_created': True,
+            'signed_url_generated': True,
+            'signed_url': 'https://storage.googleapis.com/temp-zip/signed/e2e_ship001_images.zip?signature=abc123',
+            'expiration_time': (_NOW + timedelta(hours=2)).isoformat()
+        },
+        'package_2': {
+            'processing_uuid': 'e2e-test-uuid-123',
+            'package_name': 'package_e2e_002.json',
+            'images_processed': 2,
+            'zip_created': True,
+            'signed_url_generated': True,
+            'signed_url': 'https://storage.googleapis.com/temp-zip/signed/e2e_ship002_images.zip?signature=def456',
+            'expiration_time': (_NOW + timedelta(hours=2)).isoformat()
+        }
+    }),
+    'email_service': MappingProxyType({
+        'john_smith': {
+            'processing_uuid': 'e2e-test-uuid-123',
+            'emails_sent': 1,
+            'database_updated': True,
+            'customer_email': 'john.smith@example.com',
+            'signed_url': 'https://storage.googleapis.com/temp-zip/signed/e2e_ship001_images.zip?signature=abc123',
+            'sent_at': _NOW.isoformat()
+        },
+        'jane_doe': {
+            'processing_uuid': 'e2e-test-uuid-123', 
+            'emails_sent': 1,
+            'database_updated': True,
+            'customer_email': 'jane.doe@example.com',
+            'signed_url': 'https://storage.googleapis.com/temp-zip/signed/e2e_ship002_images.zip?signature=def456',
+            'sent_at': _NOW.isoformat()
+        }
+    })
+})
+
 
 # Test fixtures
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_batch_json():
     """Complete batch JSON for end-to-end testing."""
     return {
         "batch_id": "E2E_BATCH_001",
-        "created_at": datetime.now().isoformat(),
+        "created_at": _NOW.isoformat(),
         "shipments": [
             {
                 "shipment_id": "E2E_SHIP_001",
@@ -63,92 +140,100 @@ def sample_batch_json():
         ]
     }
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_service_responses():
     """Mock responses from all services in the flow."""
+    return _MOCK_RESPONSES
+
+@pytest.fixture(scope="session")
+def mock_response_factory():
+    """Build an HTTP response stub with the given status code and JSON payload."""
+    def _make(status_code: int, payload: Dict[str, Any]) -> SimpleNamespace:
+        return SimpleNamespace(status_code=status_code, json=lambda: payload)
+    return _make
+
+@pytest.fixture(scope="session")
+def prebuilt_mocks(mock_service_responses, mock_response_factory):
+    """HTTP response mocks for each service, built once and reused by every call."""
     return {
-        'division_service': {
-            'processing_uuid': 'e2e-test-uuid-123',
-            'packages_created': 2,
-            'total_shipments': 2,
-            'status': 'completed',
-            'packages': [
-                {
-                    'package_name': 'package_e2e_001.json',
-                    'package_uri': 'gs://json-a-procesar/package_e2e_001.json',
-                    'shipments': ['E2E_SHIP_001']
-                },
-                {
-                    'package_name': 'package_e2e_002.json', 
-                    'package_uri': 'gs://json-a-procesar/package_e2e_002.json',
-                    'shipments': ['E2E_SHIP_002']
-                }
-            ]
-        },
-        'image_processing_service': {
-            'package_1': {
-                'processing_uuid': 'e2e-test-uuid-123',
-                'package_name': 'package_e2e_001.json',
-                'images_processed': 3,
-                'zip_created': True,
-                'signed_url_generated': True,
-                'signed_url': 'https://storage.googleapis.com/temp-zip/signed/e2e_ship001_images.zip?signature=abc123',
-                'expiration_time': (datetime.now() + timedelta(hours=2)).isoformat()
-            },
-            'package_2': {
-                'processing_uuid': 'e2e-test-uuid-123',
-                'package_name': 'package_e2e_002.json',
-                'images_processed': 2,
-                'zip_created': True,
-                'signed_url_generated': True,
-                'signed_url': 'https://storage.googleapis.com/temp-zip/signed/e2e_ship002_images.zip?signature=def456',
-                'expiration_time': (datetime.now() + timedelta(hours=2)).isoformat()
-            }
-        },
-        'email_service': {
-            'john_smith': {
-                'processing_uuid': 'e2e-test-uuid-123',
-                'emails_sent': 1,
-                'database_updated': True,
-                'customer_email': 'john.smith@example.com',
-                'signed_url': 'https://storage.googleapis.com/temp-zip/signed/e2e_ship001_images.zip?signature=abc123',
-                'sent_at': datetime.now().isoformat()
-            },
-            'jane_doe': {
-                'processing_uuid': 'e2e-test-uuid-123', 
-                'emails_sent': 1,
-                'database_updated': True,
-                'customer_email': 'jane.doe@example.com',
-                'signed_url': 'https://storage.googleapis.com/temp-zip/signed/e2e_ship002_images.zip?signature=def456',
-                'sent_at': datetime.now().isoformat()
-            }
-        }
+        'division': mock_response_factory(200, mock_service_responses['division_service']),
+        'package_1': mock_response_factory(200, mock_service_responses['image_processing_service']['package_1']),
+        'package_2': mock_response_factory(200, mock_service_responses['image_processing_service']['package_2']),
+        'john_smith': mock_response_factory(200, mock_service_responses['email_service']['john_smith']),
+        'jane_doe': mock_response_factory(200, mock_service_responses['email_service']['jane_doe'])
+    }
+
+
+@pytest.fixture(scope="session")
+def mock_service_post(prebuilt_mocks):
+    """requests.post stand-in that routes by service host and payload field."""
+    image_mocks = {
+        'package_e2e_001.json': prebuilt_mocks['package_1'],
+        'package_e2e_002.json': prebuilt_mocks['package_2']
+    }
+    email_mocks = {
+        'john.smith@example.com': prebuilt_mocks['john_smith'],
+        'jane.doe@example.com': prebuilt_mocks['jane_doe']
+    }
+    handlers = {
+        'division-service': lambda payload: prebuilt_mocks['division'],
+        'image-processing-service': lambda payload: image_mocks[payload['package_name']],
+        'email-service': lambda payload: email_mocks[payload['customer_email']],
+    }
+    
+    def mock_post_side_effect(url, **kwargs):
+        return handlers[urlsplit(url).hostname](kwargs.get('json', {}))
+    
+    return Mock(side_effect=mock_post_side_effect)
+
+@pytest.fixture(scope="session")
+def pipeline_state(sample_batch_json, mock_service_responses, mock_service_post):
+    """Steps 1-3 of the flow (upload, division, workflow input), run once per session."""
+    # ========== STEP 1: Simulate JSON file upload ==========
+    file_name = f"e2e_batch_{next(_seq):08x}.json"
+    json_content = json.dumps(sample_batch_json, separators=(',', ':'))
+    logger.debug("🚀 STEP 1: JSON file uploaded: %s", file_name)
+    
+    # ========== STEP 2: Division Service Processing ==========
+    # Simulate Cloud Storage trigger to Division Service
+    division_payload = {
+        'bucket': 'json-pending',
+        'name': file_name,
+        'eventType': 'google.storage.object.finalize'
+    }
+    division_response = mock_service_post(DIVISION_SERVICE_URL, json=division_payload).json()
+    logger.debug("🔄 STEP 2: Division completed: uuid=%s, packages=%d",
+                 division_response['processing_uuid'], division_response['packages_created'])
+    
+    # ========== STEP 3: Cloud Workflow Orchestration ==========
+    workflow_input = {
+        'processing_uuid': division_response['processing_uuid'],
+        'packages': mock_service_responses['division_service']['packages']
+    }
+    
+    return {
+        'file_name': file_name,
+        'json_content': json_content,
+        'division_response': division_response,
+        'workflow_input': workflow_input
     }
 
 
 class TestCompleteEndToEndFlow:
-    """Test complete flow from JSON upload to email delivery."""
+    """
+    Test complete flow from JSON upload to email delivery:
+    1. JSON upload to bucket
+    2. Division service processes and splits
+    3. Workflow triggers image processing in parallel
+    4. Image processing creates ZIPs and generates signed URLs
+    5. Email service sends notifications to customers
+    """
     
-    @pytest.mark.asyncio
-    @patch('requests.post')
     @patch('google.cloud.storage.Client')
     @patch('google.cloud.workflows_v1.ExecutionsClient')
-    async def test_full_shipment_processing_flow(self, mock_workflow_client, mock_storage, mock_requests, 
-                                                sample_batch_json, mock_service_responses):
-        """
-        Test complete end-to-end flow:
-        1. JSON upload to bucket
-        2. Division service processes and splits
-        3. Workflow triggers image processing in parallel
-        4. Image processing creates ZIPs and generates signed URLs
-        5. Email service sends notifications to customers
-        """
-        
-        # Setup storage mocks
-        mock_bucket = Mock()
-        mock_blob = Mock()
-        mock_bucket.blob.return_value = mock_blob
-        mock_storage.return_value.bucket.return_value = mock_bucket
+    def test_batch_upload_and_division(self, mock_workflow_client, mock_storage,
+                                       sample_batch_json, pipeline_state):
+        """Steps 1-3: upload is serializable, division splits the batch, workflow starts."""
         
         # Setup workflow execution mock
         mock_execution = Mock()
@@ -156,207 +241,105 @@ class TestCompleteEndToEndFlow:
         mock_execution.state = "SUCCEEDED"
         mock_workflow_client.return_value.create_execution.return_value = mock_execution
         
-        # Configure service endpoint responses
-        def mock_post_side_effect(url, **kwargs):
-            response = Mock()
-            response.status_code = 200
-            
-            if 'division-service' in url:
-                response.json.return_value = mock_service_responses['division_service']
-            elif 'image-processing-service' in url:
-                if 'package_e2e_001.json' in str(kwargs.get('json', {})):
-                    response.json.return_value = mock_service_responses['image_processing_service']['package_1']
-                else:
-                    response.json.return_value = mock_service_responses['image_processing_service']['package_2']
-            elif 'email-service' in url:
-                email_data = kwargs.get('json', {})
-                if 'john.smith' in str(email_data):
-                    response.json.return_value = mock_service_responses['email_service']['john_smith']
-                else:
-                    response.json.return_value = mock_service_responses['email_service']['jane_doe']
-            
-            return response
-        
-        mock_requests.side_effect = mock_post_side_effect
-        
-        # ========== STEP 1: Simulate JSON file upload ==========
-        print("🚀 STEP 1: Simulating JSON batch file upload...")
-        
-        file_name = f"e2e_batch_{uuid.uuid4().hex[:8]}.json"
-        mock_blob.upload_from_string.return_value = None
-        mock_blob.exists.return_value = True
-        
-        # Simulate file upload to json-pending bucket
-        json_content = json.dumps(sample_batch_json, indent=2)
-        
         # Verify file was "uploaded"
-        assert json_content is not None
-        assert json.loads(json_content)['batch_id'] == 'E2E_BATCH_001'
-        assert len(json.loads(json_content)['shipments']) == 2
-        
-        print(f"✅ JSON file uploaded: {file_name}")
-        print(f"   - Batch ID: {sample_batch_json['batch_id']}")
-        print(f"   - Shipments: {len(sample_batch_json['shipments'])}")
-        
-        # ========== STEP 2: Division Service Processing ==========
-        print("\n🔄 STEP 2: Division Service processing...")
-        
-        # Simulate Cloud Storage trigger to Division Service
-        division_payload = {
-            'bucket': 'json-pending',
-            'name': file_name,
-            'eventType': 'google.storage.object.finalize'
-        }
-        
-        division_response = await self._call_division_service(division_payload, mock_requests)
+        assert pipeline_state['json_content'] is not None
+        assert sample_batch_json['batch_id'] == 'E2E_BATCH_001'
+        assert len(sample_batch_json['shipments']) == 2
         
+        # Verify division results
+        division_response = pipeline_state['division_response']
         assert division_response['status'] == 'completed'
         assert division_response['processing_uuid'] == 'e2e-test-uuid-123'
         assert division_response['packages_created'] == 2
-        
-        print(f"✅ Division completed:")
-        print(f"   - Processing UUID: {division_response['processing_uuid']}")
-        print(f"   - Packages created: {division_response['packages_created']}")
-        
-        # ========== STEP 3: Cloud Workflow Orchestration ==========
-        print("\n🔗 STEP 3: Cloud Workflow orchestration...")
-        
-        # Simulate workflow execution with parallel package processing
-        workflow_input = {
-            'processing_uuid': division_response['processing_uuid'],
-            'packages': mock_service_responses['division_service']['packages']
-        }
+        assert len(pipeline_state['workflow_input']['packages']) == len(sample_batch_json['shipments'])
         
         # Verify workflow would be triggered
         mock_workflow_client.return_value.create_execution.assert_called_once()
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("package_idx", [0, 1])
+    async def test_single_package_flow(self, package_idx, sample_batch_json, pipeline_state, mock_service_post):
+        """Steps 4-5 for one package: ZIP with signed URL, then the customer's email."""
+        division_response = pipeline_state['division_response']
+        package = pipeline_state['workflow_input']['packages'][package_idx]
+        shipment = sample_batch_json['shipments'][package_idx]
+        
+        # ========== STEP 4: Image Processing Service ==========
+        image_response = await self._call_image_processing_service({
+            'processing_uuid': division_response['processing_uuid'],
+            'package_uri': package['package_uri'],
+            'package_name': package['package_name']
+        }, mock_service_post)
         
-        print("✅ Workflow execution started")
-        
-        # ========== STEP 4: Image Processing Service (Parallel) ==========
-        print("\n🖼️  STEP 4: Image Processing Service (parallel processing)...")
+        assert image_response['package_name'] == package['package_name']
+        assert image_response['zip_created'] is True
+        assert image_response['signed_url_generated'] is True
+        assert image_response['signed_url'].startswith('https://'), "Signed URLs should be HTTPS"
+        assert 'signature=' in image_response['signed_url'], "Signed URLs should contain signature parameter"
         
-        image_results = []
+        logger.debug("🖼️  STEP 4: Package %s processed: %d images",
+                     package['package_name'], image_response['images_processed'])
         
-        # Process each package in parallel (simulated)
-        for i, package in enumerate(mock_service_responses['division_service']['packages'], 1):
-            print(f"   Processing package {i}: {package['package_name']}")
-            
-            image_payload = {
+        # ========== STEP 5: Email Service Notification ==========
+        email_response = await self._call_email_service({
+            'processing_uuid': division_response['processing_uuid'],
+            'customer_email': shipment['customer']['email'],
+            'customer_name': shipment['customer']['name'],
+            'signed_urls': [image_response['signed_url']],
+            'expiration_time': image_response['expiration_time'],
+            'shipment_id': shipment['shipment_id']
+        }, mock_service_post)
+        
+        assert email_response['emails_sent'] == 1
+        assert email_response['database_updated'] is True
+        assert email_response['customer_email'] == shipment['customer']['email']
+        assert email_response['signed_url'] == image_response['signed_url'], \
+            "Each customer should receive their own package's signed URL"
+        
+        logger.debug("📧 STEP 5: Email sent to: %s", email_response['customer_email'])
+
+    @pytest.mark.asyncio
+    async def test_batch_fan_out(self, sample_batch_json, pipeline_state, mock_service_post):
+        """Steps 4-5 across the batch: one distinct signed URL per package, every customer emailed."""
+        division_response = pipeline_state['division_response']
+        shipments = sample_batch_json['shipments']
+
+        # Process all packages in parallel
+        image_results = await asyncio.gather(*[
+            self._call_image_processing_service({
                 'processing_uuid': division_response['processing_uuid'],
                 'package_uri': package['package_uri'],
                 'package_name': package['package_name']
-            }
-            
-            image_response = await self._call_image_processing_service(image_payload, mock_requests)
-            image_results.append(image_response)
-            
-            assert image_response['zip_created'] is True
-            assert image_response['signed_url_generated'] is True
-            assert 'signed_url' in image_response
-            
-            print(f"   ✅ Package {i} processed: {image_response['images_processed']} images")
-        
-        print(f"✅ All {len(image_results)} packages processed with signed URLs")
-        
-        # ========== STEP 5: Email Service Notifications ==========
-        print("\n📧 STEP 5: Email Service sending notifications...")
-        
-        email_results = []
-        
-        # Send email to each customer
-        for i, shipment in enumerate(sample_batch_json['shipments'], 1):
-            corresponding_package_result = image_results[i-1]
-            
-            email_payload = {
+            }, mock_service_post)
+            for package in pipeline_state['workflow_input']['packages']
+        ])
+
+        # Send email to each customer in parallel
+        email_results = await asyncio.gather(*[
+            self._call_email_service({
                 'processing_uuid': division_response['processing_uuid'],
                 'customer_email': shipment['customer']['email'],
                 'customer_name': shipment['customer']['name'],
-                'signed_urls': [corresponding_package_result['signed_url']],
-                'expiration_time': corresponding_package_result['expiration_time'],
+                'signed_urls': [package_result['signed_url']],
+                'expiration_time': package_result['expiration_time'],
                 'shipment_id': shipment['shipment_id']
-            }
-            
-            email_response = await self._call_email_service(email_payload, mock_requests)
-            email_results.append(email_response)
-            
-            assert email_response['emails_sent'] == 1
-            assert email_response['database_updated'] is True
-            assert email_response['customer_email'] == shipment['customer']['email']
-            
-            print(f"   ✅ Email sent to: {email_response['customer_email']}")
-        
-        # ========== STEP 6: Validation and Assertions ==========
-        print("\n✅ STEP 6: End-to-End validation...")
-        
-        # Verify complete flow
-        assert len(image_results) == 2, "Should have processed 2 packages"
-        assert len(email_results) == 2, "Should have sent 2 emails"
-        
-        # Verify all signed URLs are unique and valid format
-        signed_urls = [result['signed_url'] for result in image_results]
+            }, mock_service_post)
+            for shipment, package_result in zip(shipments, image_results)
+        ])
+
+        signed_urls = [image_response['signed_url'] for image_response in image_results]
+        emailed_customers = {email_response['customer_email'] for email_response in email_results}
         assert len(set(signed_urls)) == len(signed_urls), "All signed URLs should be unique"
-        
-        for url in signed_urls:
-            assert url.startswith('https://'), "Signed URLs should be HTTPS"
-            assert 'signature=' in url, "Signed URLs should contain signature parameter"
-        
-        # Verify customer emails match
-        expected_emails = {shipment['customer']['email'] for shipment in sample_batch_json['shipments']}
-        actual_emails = {result['customer_email'] for result in email_results}
-        assert expected_emails == actual_emails, "All customers should receive emails"
-        
-        print("🎉 END-TO-END TEST COMPLETED SUCCESSFULLY!")
-        print(f"   - Processed: {division_response['total_shipments']} shipments")
-        print(f"   - Created: {division_response['packages_created']} packages")
-        print(f"   - Generated: {len(signed_urls)} signed URLs")
-        print(f"   - Sent: {sum(r['emails_sent'] for r in email_results)} emails")
-    
-    async def _call_division_service(self, payload: Dict[str, Any], mock_requests) -> Dict[str, Any]:
-        """Simulate call to Division Service."""
-        # This would be a real HTTP call in actual implementation
-        response = mock_requests.return_value
-        response.json.return_value = {
-            'processing_uuid': 'e2e-test-uuid-123',
-            'packages_created': 2,
-            'total_shipments': 2,
-            'status': 'completed'
-        }
-        return response.json()
-    
+        assert emailed_customers == {shipment['customer']['email'] for shipment in shipments}, \
+            "Every customer should receive an email"
+
     async def _call_image_processing_service(self, payload: Dict[str, Any], mock_requests) -> Dict[str, Any]:
         """Simulate call to Image Processing Service."""
-        package_name = payload['package_name']
-        if 'e2e_001' in package_name:
-            return {
-                'processing_uuid': 'e2e-test-uuid-123',
-                'package_name': package_name,
-                'images_processed': 3,
-                'zip_created': True,
-                'signed_url_generated': True,
-                'signed_url': 'https://storage.googleapis.com/temp-zip/signed/e2e_ship001_images.zip?signature=abc123',
-                'expiration_time': (datetime.now() + timedelta(hours=2)).isoformat()
-            }
-        else:
-            return {
-                'processing_uuid': 'e2e-test-uuid-123',
-                'package_name': package_name,
-                'images_processed': 2,
-                'zip_created': True,
-                'signed_url_generated': True,
-                'signed_url': 'https://storage.googleapis.com/temp-zip/signed/e2e_ship002_images.zip?signature=def456',
-                'expiration_time': (datetime.now() + timedelta(hours=2)).isoformat()
-            }
+        return mock_requests(IMAGE_PROCESSING_SERVICE_URL, json=payload).json()
     
     async def _call_email_service(self, payload: Dict[str, Any], mock_requests) -> Dict[str, Any]:
         """Simulate call to Email Service."""
-        return {
-            'processing_uuid': payload['processing_uuid'],
-            'emails_sent': 1,
-            'database_updated': True,
-            'customer_email': payload['customer_email'],
-            'signed_url': payload['signed_urls'][0],
-            'sent_at': datetime.now().isoformat()
-        }
+        return mock_requests(EMAIL_SERVICE_URL, json=payload).json()
 
 
 class TestEndToEndErrorScenarios:
@@ -364,34 +347,29 @@ class TestEndToEndErrorScenarios:
     
     @pytest.mark.asyncio
     @patch('requests.post')
-    async def test_image_processing_failure_with_email_notification(self, mock_requests, sample_batch_json):
+    async def test_image_processing_failure_with_email_notification(self, mock_requests, sample_batch_json,
+                                                                    mock_response_factory):
         """Test error handling when image processing fails."""
         
         # Configure division service to succeed
-        division_response = Mock()
-        division_response.status_code = 200
-        division_response.json.return_value = {
+        division_response = mock_response_factory(200, {
             'processing_uuid': 'error-test-uuid-456',
             'packages_created': 1,
             'total_shipments': 1,
             'status': 'completed'
-        }
+        })
         
         # Configure image processing to fail
-        image_error_response = Mock()
-        image_error_response.status_code = 500
-        image_error_response.json.return_value = {
+        image_error_response = mock_response_factory(500, {
             'error': 'Failed to download images from source bucket'
-        }
+        })
         
         # Configure email service to send error notification
-        email_response = Mock()
-        email_response.status_code = 200
-        email_response.json.return_value = {
+        email_response = mock_response_factory(200, {
             'error_notification_sent': True,
             'customer_email': 'customer@example.com',
             'notification_type': 'image_processing_failed'
-        }
+        })
         
         def mock_post_side_effect(url, **kwargs):
             if 'division-service' in url:
@@ -422,21 +400,17 @@ class TestEndToEndErrorScenarios:
     
     @pytest.mark.asyncio
     @patch('requests.post')
-    async def test_partial_success_scenario(self, mock_requests, sample_batch_json):
+    async def test_partial_success_scenario(self, mock_requests, sample_batch_json, mock_response_factory):
         """Test scenario where some packages succeed and others fail."""
         
-        success_response = Mock()
-        success_response.status_code = 200
-        success_response.json.return_value = {
+        success_response = mock_response_factory(200, {
             'zip_created': True,
             'signed_url': 'https://storage.googleapis.com/signed-url-success'
-        }
+        })
         
-        failure_response = Mock()
-        failure_response.status_code = 500
-        failure_response.json.return_value = {
+        failure_response = mock_response_factory(500, {
             'error': 'Image download failed'
-        }
+        })
         
         call_count = 0
         def mock_post_side_effect(url, **kwargs):
@@ -471,44 +445,28 @@ class TestEndToEndPerformance:
     
     @pytest.mark.asyncio
     @patch('requests.post')
-    async def test_processing_time_requirements(self, mock_requests, sample_batch_json):
-        """Test that processing completes within acceptable time limits."""
+    async def test_processing_time_requirements(self, mock_requests, sample_batch_json, mock_response_factory):
+        """Each stage calls the next service exactly once, in flow order (round-trip time is logged)."""
         
         # Configure fast responses
-        fast_response = Mock()
-        fast_response.status_code = 200
-        fast_response.json.return_value = {'status': 'completed'}
-        mock_requests.return_value = fast_response
-        
-        # Measure processing time
-        start_time = time.time()
-        
-        # Simulate processing steps
-        division_start = time.time()
-        await asyncio.sleep(0.1)  # Simulate division processing
-        division_time = time.time() - division_start
-        
-        image_start = time.time()
-        await asyncio.sleep(0.2)  # Simulate image processing
-        image_time = time.time() - image_start
-        
-        email_start = time.time()
-        await asyncio.sleep(0.1)  # Simulate email sending
-        email_time = time.time() - email_start
-        
-        total_time = time.time() - start_time
-        
-        # Verify performance requirements
-        assert division_time < 5.0, "Division should complete in under 5 seconds"
-        assert image_time < 30.0, "Image processing should complete in under 30 seconds"
-        assert email_time < 5.0, "Email sending should complete in under 5 seconds"
-        assert total_time < 45.0, "Total end-to-end processing should complete in under 45 seconds"
-        
-        print(f"Performance metrics:")
-        print(f"  Division: {division_time:.2f}s")
-        print(f"  Image Processing: {image_time:.2f}s") 
-        print(f"  Email Sending: {email_time:.2f}s")
-        print(f"  Total: {total_time:.2f}s")
+        mock_requests.return_value = mock_response_factory(200, {'status': 'completed'})
+        shipment = sample_batch_json['shipments'][0]
+        
+        # Measure the (mocked) service round-trips, no artificial waits
+        start_time = time.perf_counter()
+        requests.post(DIVISION_SERVICE_URL, json={'name': 'perf_batch.json'})
+        requests.post(IMAGE_PROCESSING_SERVICE_URL, json={'package_name': 'package_perf_001.json'})
+        requests.post(EMAIL_SERVICE_URL, json={'customer_email': shipment['customer']['email']})
+        total_time = time.perf_counter() - start_time
+        
+        # Mocked calls take microseconds, so a time budget here could never fail; check the sequence instead
+        assert mock_requests.call_args_list == [
+            call(DIVISION_SERVICE_URL, json={'name': 'perf_batch.json'}),
+            call(IMAGE_PROCESSING_SERVICE_URL, json={'package_name': 'package_perf_001.json'}),
+            call(EMAIL_SERVICE_URL, json={'customer_email': shipment['customer']['email']}),
+        ]
+        
+        logger.debug("Performance metrics: total=%.4fs", total_time)
 
 
 class TestWorkflowIntegration:
@@ -525,11 +483,11 @@ class TestWorkflowIntegration:
         mock_execution.state = "ACTIVE"
         mock_workflow_client.return_value.create_execution.return_value = mock_execution
         
-        # Setup execution status progression
+        # Setup execution status progression (states are only built as they are polled)
         status_sequence = ["ACTIVE", "ACTIVE", "SUCCEEDED"]
-        mock_workflow_client.return_value.get_execution.side_effect = [
-            Mock(state=status) for status in status_sequence
-        ]
+        mock_workflow_client.return_value.get_execution.side_effect = (
+            SimpleNamespace(state=status) for status in status_sequence
+        )
         
         # Test workflow execution
         workflow_input = {
@@ -543,9 +501,13 @@ class TestWorkflowIntegration:
         execution = mock_workflow_client.return_value.create_execution.return_value
         assert execution.name.endswith('test')
         
-        # Verify workflow reaches completion
-        final_status = mock_workflow_client.return_value.get_execution.side_effect[-1]
+        # Verify workflow reaches completion by polling its execution
+        get_execution = mock_workflow_client.return_value.get_execution
+        final_status = get_execution()
+        while final_status.state == "ACTIVE":
+            final_status = get_execution()
         assert final_status.state == "SUCCEEDED"
+        assert get_execution.call_count == len(status_sequence)
     
     @pytest.mark.asyncio
     @patch('google.cloud.workflows_v1.ExecutionsClient')
@@ -553,10 +515,10 @@ class TestWorkflowIntegration:
         """Test workflow execution failure handling."""
         
         # Setup mock workflow failure
-        mock_execution = Mock()
-        mock_execution.state = "FAILED"
-        mock_execution.error = Mock()
-        mock_execution.error.payload = '{"error": "Step failed"}'
+        mock_execution = SimpleNamespace(
+            state="FAILED",
+            error=SimpleNamespace(payload='{"error": "Step failed"}')
+        )
         mock_workflow_client.return_value.create_execution.return_value = mock_execution
         
         # Test that workflow failure is handled appropriately
@@ -573,36 +535,44 @@ class TestEndToEndLoad:
     async def test_concurrent_batch_processing(self):
         """Test processing multiple batches concurrently."""
         
+        inflight = 0
+        max_inflight = 0
+        
         async def process_single_batch(batch_id: str):
             """Simulate processing a single batch."""
-            await asyncio.sleep(0.5)  # Simulate processing time
+            nonlocal inflight, max_inflight
+            inflight += 1
+            max_inflight = max(max_inflight, inflight)
+            await asyncio.sleep(0)  # Yield so the other batches can start
+            inflight -= 1
             return {
                 'batch_id': batch_id,
-                'status': 'completed',
-                'processing_time': 0.5
+                'status': 'completed'
             }
         
         # Process multiple batches concurrently
         batch_ids = [f"LOAD_BATCH_{i:03d}" for i in range(5)]
         
-        start_time = time.time()
-        results = await asyncio.gather(*[
-            process_single_batch(batch_id) for batch_id in batch_ids
-        ])
-        total_time = time.time() - start_time
+        start_time = time.perf_counter()
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(process_single_batch(batch_id)) for batch_id in batch_ids]
+        results = [task.result() for task in tasks]
+        total_time = time.perf_counter() - start_time
         
-        # Verify concurrent processing is faster than sequential
+        # Verify batches actually overlapped instead of running one after another
         assert len(results) == 5
+        assert [r['batch_id'] for r in results] == batch_ids
         assert all(r['status'] == 'completed' for r in results)
-        assert total_time < 2.5  # Should be much faster than 5 * 0.5 seconds
+        assert max_inflight >= 2
+        assert total_time < 0.5  # Regression guard against re-serialising the batches
         
-        print(f"Processed {len(results)} batches concurrently in {total_time:.2f}s")
+        logger.debug("Processed %d batches concurrently in %.2fs", len(results), total_time)
 
 
 if __name__ == "__main__":
     # Run specific test for development
     import sys
     if len(sys.argv) > 1 and sys.argv[1] == "run-e2e":
-        pytest.main([__file__ + "::TestCompleteEndToEndFlow::test_full_shipment_processing_flow", "-v", "-s"])
+        pytest.main([__file__ + "::TestCompleteEndToEndFlow", "-v", "-s", "-n0"])
     else:
         pytest.main([__file__, "-v"])
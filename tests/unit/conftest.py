@@ -0,0 +1,174 @@
+"""
+Shared fixtures for service unit tests.
+Service modules are imported lazily so collection never pays for Flask and its dependencies.
+"""
+import pytest
+import sys
+import os
+from types import SimpleNamespace
+from typing import Dict
+from unittest.mock import patch, Mock, MagicMock
+from google.api_core.exceptions import NotFound
+
+SERVICES_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'services')
+SHARED_UTILS_SRC = os.path.join(SERVICES_DIR, 'shared_utils', 'src')
+EMAIL_SERVICE_SRC = os.path.join(SERVICES_DIR, 'email_service', 'src')
+IMAGE_SERVICE_SRC = os.path.join(SERVICES_DIR, 'image_processing_service', 'src')
+
+EMAIL_MODULE_MOCKS = (
+    'config',
+    'logger',
+    'database_service',
+    'pubsub_service',
+    'services.email_sender',
+    'services.template_manager',
+    'services.notification_manager',
+)
+
+IMAGE_MODULE_MOCKS = (
+    'config',
+    'logger',
+    'storage_service',
+    'database_service',
+    'pubsub_service',
+    'services.image_downloader',
+    'services.zip_creator',
+    'services.signed_url_generator',
+    'services.cleanup_scheduler',
+    'services.package_processor',
+)
+
+
+@pytest.fixture(scope="session")
+def email_main():
+    """Import the email service's main module with shared services mocked out."""
+    # Plain Mock stubs satisfy main's 'from x import y' statements without MagicMock's magic methods
+    # patch.dict drops 'main' from sys.modules on exit, so it never clashes with other services
+    with patch.object(sys, 'path', [EMAIL_SERVICE_SRC, SHARED_UTILS_SRC, *sys.path]), \
+            patch.dict(sys.modules, {name: Mock() for name in EMAIL_MODULE_MOCKS}):
+        import main
+    return main
+
+
+@pytest.fixture(scope="session")
+def image_main():
+    """Import the image processing service's main module with shared services mocked out."""
+    with patch.object(sys, 'path', [IMAGE_SERVICE_SRC, SHARED_UTILS_SRC, *sys.path]), \
+            patch.dict(sys.modules, {name: MagicMock() for name in IMAGE_MODULE_MOCKS}):
+        import main
+    return main
+
+
+@pytest.fixture
+def email_deps(mocker, email_main):
+    """Patch the email service collaborators; tests only configure return values."""
+    return SimpleNamespace(
+        notification=mocker.patch.object(email_main, 'notification_manager'),
+        email=mocker.patch.object(email_main, 'email_sender'),
+        template=mocker.patch.object(email_main, 'template_manager'),
+        db=mocker.patch.object(email_main, 'database_service'),
+        pubsub=mocker.patch.object(email_main, 'pubsub_service'),
+        config=mocker.patch.object(email_main, 'config'),
+    )
+
+
+@pytest.fixture
+def image_deps(mocker, image_main):
+    """Patch the image processing service collaborators; tests only configure return values."""
+    return SimpleNamespace(
+        db=mocker.patch.object(image_main, 'database_service'),
+        storage=mocker.patch.object(image_main, 'storage_service'),
+        processor=mocker.patch.object(image_main, 'package_processor'),
+        scheduler=mocker.patch.object(image_main, 'cleanup_scheduler'),
+        pubsub=mocker.patch.object(image_main, 'pubsub_service'),
+        config=mocker.patch.object(image_main, 'config'),
+    )
+
+
+# In-memory stand-ins for google.cloud.storage (much cheaper than Mock per call)
+class FakeBlob:
+    """Blob backed by a shared dict keyed by (bucket, name)."""
+    __slots__ = ('name', 'bucket_name', 'chunk_size', '_store', '_key')
+
+    def __init__(self, store: Dict, bucket_name: str, name: str):
+        self._store = store
+        self._key = (bucket_name, name)
+        self.bucket_name = bucket_name
+        self.name = name
+        self.chunk_size = None
+
+    @property
+    def size(self):
+        data = self._store.get(self._key)
+        return None if data is None else len(data)
+
+    def exists(self) -> bool:
+        return self._key in self._store
+
+    def upload_from_string(self, data, content_type=None):
+        self._store[self._key] = data if isinstance(data, bytes) else data.encode('utf-8')
+
+    def upload_from_file(self, file_obj, size=None, content_type=None):
+        self._store[self._key] = file_obj.read() if size is None else file_obj.read(size)
+
+    def upload_from_filename(self, filename, content_type=None):
+        with open(filename, 'rb') as f:
+            self._store[self._key] = f.read()
+
+    def download_as_bytes(self) -> bytes:
+        try:
+            return self._store[self._key]
+        except KeyError:
+            raise NotFound(f"{self.bucket_name}/{self.name}")
+
+    def download_to_filename(self, filename):
+        data = self.download_as_bytes()
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+    def delete(self):
+        if self._store.pop(self._key, None) is None:
+            raise NotFound(f"{self.bucket_name}/{self.name}")
+
+    def generate_signed_url(self, **kwargs) -> str:
+        return "https://signed-url.example.com"
+
+
+class FakeBucket:
+    """Bucket view over the shared in-memory store."""
+    __slots__ = ('name', '_store')
+
+    def __init__(self, store: Dict, name: str):
+        self._store = store
+        self.name = name
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self._store, self.name, name)
+
+    def list_blobs(self, prefix: str = "", **kwargs):
+        return [
+            FakeBlob(self._store, bucket_name, name)
+            for bucket_name, name in list(self._store)
+            if bucket_name == self.name and name.startswith(prefix)
+        ]
+
+
+class FakeClient:
+    """storage.Client replacement whose buckets share one dict."""
+
+    def __init__(self, store: Dict):
+        self.store = store
+
+    def bucket(self, name: str) -> FakeBucket:
+        return FakeBucket(self.store, name)
+
+
+@pytest.fixture
+def gcs_store(monkeypatch, image_main):
+    """Route the image service's GCS client to an in-memory fake; yields its (bucket, name) -> bytes store."""
+    store = {}
+    monkeypatch.setattr(image_main, 'get_storage_client', lambda: FakeClient(store))
+    # get_bucket caches bucket handles: drop them so they are rebuilt from the fake (and after the test)
+    image_main.get_bucket.cache_clear()
+    yield store
+    image_main.get_bucket.cache_clear()
@@ -3,36 +3,57 @@ Unit tests for Email Service.
 Tests all endpoints and core functionality for email processing.
 """
 import pytest
-import json
+import base64
+import functools
 import uuid
-from unittest.mock import Mock, patch, MagicMock
-from datetime import datetime, timedelta
-import sys
-import os
-
-# Add services to path for testing
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'services', 'email_service', 'src'))
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'services', 'shared_utils', 'src'))
-
-# Mock shared services before import
-with patch.dict(sys.modules, {
-    'config': MagicMock(),
-    'logger': MagicMock(),
-    'database_service': MagicMock(),
-    'pubsub_service': MagicMock(),
-    'services.email_sender': MagicMock(),
-    'services.template_manager': MagicMock(),
-    'services.notification_manager': MagicMock()
-}):
-    import main as email_main
-
-@pytest.fixture
-def app():
-    """Create Flask test app."""
+import orjson
+from unittest.mock import ANY, DEFAULT, patch
+
+# Timestamp for mocked payloads; tests never assert on its value
+_FIXED_TS = '2024-01-01T00:00:00'
+
+
+@functools.lru_cache(maxsize=16)
+def _envelope_cached(payload_json):
+    """Build a Pub/Sub push envelope from an already serialized message (JSON bytes)."""
+    return {
+        'message': {
+            'data': base64.b64encode(payload_json).decode(),
+            'messageId': '123456789'
+        }
+    }
+
+
+def _envelope(message_data):
+    """Wrap a message in a Pub/Sub push envelope (cached by canonical orjson bytes)."""
+    return _envelope_cached(orjson.dumps(message_data, option=orjson.OPT_SORT_KEYS))
+
+# Pub/Sub envelopes are static: encode them once at import
+_ENV_COMPLETION = _envelope({'action': 'send_completion_email', 'processing_uuid': 'test-uuid-123'})
+_ENV_ERROR = _envelope({'action': 'send_error_notification', 'error_type': 'processing_failed'})
+_ENV_UNKNOWN = _envelope({'action': 'unknown_action'})
+
+
+def assert_subset(response, status_code, /, **expected):
+    """Assert the status code and that the JSON body contains every expected field."""
+    assert response.status_code == status_code
+    body = response.get_json()
+    assert expected.items() <= body.items()
+    return body
+
+
+def call_view(email_main, view, payload=None):
+    """Call a view function directly under a request context, skipping URL routing."""
+    with email_main.app.test_request_context(method='POST', json=payload):
+        return getattr(email_main, view)()
+
+@pytest.fixture(scope="session")
+def app(email_main):
+    """Create Flask test app (shared across the session; tests never mutate its config)."""
     email_main.app.config['TESTING'] = True
     return email_main.app.test_client()
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def valid_completion_request():
     """Valid completion email request."""
     return {
@@ -43,12 +64,12 @@ def valid_completion_request():
             'https://signed-url.example.com/package1.zip',
             'https://signed-url.example.com/package2.zip'
         ],
-        'expiration_time': (datetime.now() + timedelta(hours=2)).isoformat(),
+        'expiration_time': '2024-01-01T02:00:00',
         'total_shipments': 10,
         'total_packages': 2
     }
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def valid_error_notification():
     """Valid error notification request."""
     return {
@@ -59,7 +80,7 @@ def valid_error_notification():
         'customer_name': 'Test Customer'
     }
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def valid_custom_email():
     """Valid custom email request."""
     return {
@@ -78,137 +99,104 @@ class TestHealthEndpoints:
     
     def test_health_check(self, app):
         """Test health check endpoint returns healthy status."""
-        response = app.get('/health')
-        data = json.loads(response.data)
-        
-        assert response.status_code == 200
-        assert data['status'] == 'healthy'
-        assert data['service'] == 'email-service'
+        data = assert_subset(app.get('/health'), 200, status='healthy', service='email-service')
         assert 'timestamp' in data
 
-    @patch('main.database_service')
-    @patch('main.email_sender')
-    @patch('main.template_manager')
-    def test_status_check_healthy(self, mock_template, mock_email, mock_db, app):
+    def test_status_check_healthy(self, email_deps, app):
         """Test status endpoint when all dependencies are healthy."""
-        mock_db.check_connectivity.return_value = True
-        mock_email.check_smtp_connectivity.return_value = True
-        mock_template.get_available_templates.return_value = ['completion', 'error', 'custom']
-        
-        response = app.get('/status')
-        data = json.loads(response.data)
+        email_deps.db.check_connectivity.return_value = True
+        email_deps.email.check_smtp_connectivity.return_value = True
+        email_deps.template.get_available_templates.return_value = ['completion', 'error', 'custom']
         
-        assert response.status_code == 200
-        assert data['status'] == 'ready'
+        data = assert_subset(app.get('/status'), 200, status='ready', service='email-service')
         assert data['dependencies']['database'] == 'healthy'
         assert data['dependencies']['smtp_server'] == 'healthy'
-        assert data['service'] == 'email-service'
         assert len(data['configuration']['templates_available']) == 3
 
-    @patch('main.database_service')
-    @patch('main.email_sender')
-    def test_status_check_unhealthy_smtp(self, mock_email, mock_db, app):
+    def test_status_check_unhealthy_smtp(self, email_deps, app):
         """Test status endpoint when SMTP is unhealthy."""
-        mock_db.check_connectivity.return_value = True
-        mock_email.check_smtp_connectivity.return_value = False
+        email_deps.db.check_connectivity.return_value = True
+        email_deps.email.check_smtp_connectivity.return_value = False
         
         response = app.get('/status')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 200
         assert data['dependencies']['smtp_server'] == 'unhealthy'
         assert data['dependencies']['database'] == 'healthy'
 
-    @patch('main.database_service')
-    def test_status_check_exception(self, mock_db, app):
+    def test_status_check_exception(self, email_deps, app):
         """Test status endpoint when exception occurs."""
-        mock_db.check_connectivity.side_effect = Exception("DB connection failed")
-        
-        response = app.get('/status')
-        data = json.loads(response.data)
+        email_deps.db.check_connectivity.side_effect = Exception("DB connection failed")
         
-        assert response.status_code == 500
-        assert data['status'] == 'error'
+        data = assert_subset(app.get('/status'), 500, status='error')
         assert 'error' in data
 
 
+class TestRequestValidation:
+    """Test that endpoints reject missing or incomplete payloads."""
+    
+    @pytest.mark.parametrize("view,payload,expected_fragment", [
+        ('send_completion_email', None, ''),
+        ('send_completion_email', {
+            'customer_email': 'customer@example.com',
+            'signed_urls': ['https://example.com/package.zip']
+        }, 'processing_uuid requerido'),
+        ('send_error_notification', None, ''),
+        ('send_custom_email', {'to_email': 'recipient@example.com'}, 'campos requeridos'),
+    ], ids=['completion-no-data', 'completion-missing-uuid', 'error-no-data', 'custom-missing-fields'])
+    def test_bad_request(self, email_main, view, payload, expected_fragment):
+        """Test endpoints return 400 with an error message for invalid requests."""
+        data, status = call_view(email_main, view, payload)
+        
+        assert status == 400
+        assert expected_fragment in data['error'].lower()
+
+
 class TestSendCompletionEmailEndpoint:
     """Test the main completion email sending endpoint."""
     
-    @patch('main.notification_manager')
-    def test_send_completion_email_success(self, mock_notification, app, valid_completion_request):
+    def test_send_completion_email_success(self, email_deps, app, valid_completion_request):
         """Test successful completion email sending."""
         expected_result = {
             'processing_uuid': 'test-uuid-123',
             'emails_sent': 1,
             'database_updated': True,
             'customer_email': 'customer@example.com',
-            'sent_at': datetime.now().isoformat()
+            'sent_at': _FIXED_TS
         }
-        mock_notification.process_completion_notification.return_value = expected_result
+        email_deps.notification.process_completion_notification.return_value = expected_result
         
         response = app.post('/send-completion-email', json=valid_completion_request)
-        data = json.loads(response.data)
-        
-        assert response.status_code == 200
-        assert data['processing_uuid'] == 'test-uuid-123'
-        assert data['emails_sent'] == 1
-        assert data['database_updated'] is True
+        assert_subset(response, 200, processing_uuid='test-uuid-123', emails_sent=1, database_updated=True)
         
         # Verify method was called with correct arguments
-        mock_notification.process_completion_notification.assert_called_once_with(
+        email_deps.notification.process_completion_notification.assert_called_once_with(
             processing_uuid='test-uuid-123',
             notification_data=valid_completion_request,
-            trace_id=unittest.mock.ANY
+            trace_id=ANY
         )
 
-    def test_send_completion_email_no_data(self, app):
-        """Test sending completion email with no request data."""
-        response = app.post('/send-completion-email')
-        data = json.loads(response.data)
-        
-        assert response.status_code == 400
-        assert 'error' in data
-
-    def test_send_completion_email_missing_uuid(self, app):
-        """Test sending completion email with missing processing_uuid."""
-        invalid_request = {
-            'customer_email': 'customer@example.com',
-            'signed_urls': ['https://example.com/package.zip']
-        }
-        
-        response = app.post('/send-completion-email', json=invalid_request)
-        data = json.loads(response.data)
-        
-        assert response.status_code == 400
-        assert 'processing_uuid requerido' in data['error']
-
-    @patch('main.notification_manager')
-    @patch('main.pubsub_service')
-    def test_send_completion_email_exception_with_pubsub(self, mock_pubsub, mock_notification, 
-                                                       app, valid_completion_request):
+    def test_send_completion_email_exception_with_pubsub(self, email_deps, app, valid_completion_request):
         """Test exception handling with Pub/Sub error publishing."""
-        mock_notification.process_completion_notification.side_effect = Exception("Email sending failed")
+        email_deps.notification.process_completion_notification.side_effect = Exception("Email sending failed")
         
         response = app.post('/send-completion-email', json=valid_completion_request)
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 500
         assert 'error' in data
         
         # Verify error was published to Pub/Sub
-        mock_pubsub.publish_error.assert_called_once()
+        email_deps.pubsub.publish_error.assert_called_once()
 
-    @patch('main.notification_manager')
-    @patch('main.pubsub_service')
-    def test_send_completion_email_pubsub_publish_fails(self, mock_pubsub, mock_notification, 
-                                                       app, valid_completion_request):
+    def test_send_completion_email_pubsub_publish_fails(self, email_deps, app, valid_completion_request):
         """Test when Pub/Sub error publishing also fails."""
-        mock_notification.process_completion_notification.side_effect = Exception("Email sending failed")
-        mock_pubsub.publish_error.side_effect = Exception("Pub/Sub failed")
+        email_deps.notification.process_completion_notification.side_effect = Exception("Email sending failed")
+        email_deps.pubsub.publish_error.side_effect = Exception("Pub/Sub failed")
         
         response = app.post('/send-completion-email', json=valid_completion_request)
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 500
         assert 'error' in data
@@ -217,42 +205,28 @@ class TestSendCompletionEmailEndpoint:
 class TestSendErrorNotificationEndpoint:
     """Test error notification sending endpoint."""
     
-    @patch('main.notification_manager')
-    def test_send_error_notification_success(self, mock_notification, app, valid_error_notification):
+    def test_send_error_notification_success(self, email_deps, app, valid_error_notification):
         """Test successful error notification sending."""
         expected_result = {
             'processing_uuid': 'error-uuid-123',
             'error_notification_sent': True,
             'notification_type': 'image_processing_failed',
-            'sent_at': datetime.now().isoformat()
+            'sent_at': _FIXED_TS
         }
-        mock_notification.send_error_notification.return_value = expected_result
+        email_deps.notification.send_error_notification.return_value = expected_result
         
         response = app.post('/send-error-notification', json=valid_error_notification)
-        data = json.loads(response.data)
-        
-        assert response.status_code == 200
-        assert data['error_notification_sent'] is True
-        assert data['processing_uuid'] == 'error-uuid-123'
+        assert_subset(response, 200, error_notification_sent=True, processing_uuid='error-uuid-123')
         
-        mock_notification.send_error_notification.assert_called_once_with(
+        email_deps.notification.send_error_notification.assert_called_once_with(
             error_type='image_processing_failed',
             error_message='Failed to download images from bucket',
             processing_uuid='error-uuid-123',
             additional_data=valid_error_notification,
-            trace_id=unittest.mock.ANY
+            trace_id=ANY
         )
 
-    def test_send_error_notification_no_data(self, app):
-        """Test sending error notification with no request data."""
-        response = app.post('/send-error-notification')
-        data = json.loads(response.data)
-        
-        assert response.status_code == 400
-        assert 'error' in data
-
-    @patch('main.notification_manager')
-    def test_send_error_notification_default_values(self, mock_notification, app):
+    def test_send_error_notification_default_values(self, email_deps, app):
         """Test error notification with default values for optional fields."""
         minimal_request = {}
         
@@ -261,28 +235,27 @@ class TestSendErrorNotificationEndpoint:
             'error_notification_sent': True,
             'notification_type': 'general_error'
         }
-        mock_notification.send_error_notification.return_value = expected_result
+        email_deps.notification.send_error_notification.return_value = expected_result
         
         response = app.post('/send-error-notification', json=minimal_request)
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 200
         
-        mock_notification.send_error_notification.assert_called_once_with(
+        email_deps.notification.send_error_notification.assert_called_once_with(
             error_type='general_error',
             error_message='Error no especificado',
             processing_uuid='unknown',
             additional_data=minimal_request,
-            trace_id=unittest.mock.ANY
+            trace_id=ANY
         )
 
-    @patch('main.notification_manager')
-    def test_send_error_notification_exception(self, mock_notification, app):
+    def test_send_error_notification_exception(self, email_deps, app):
         """Test error notification when exception occurs."""
-        mock_notification.send_error_notification.side_effect = Exception("Notification failed")
+        email_deps.notification.send_error_notification.side_effect = Exception("Notification failed")
         
         response = app.post('/send-error-notification', json={'error_type': 'test'})
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 500
         assert 'error' in data
@@ -291,47 +264,28 @@ class TestSendErrorNotificationEndpoint:
 class TestSendCustomEmailEndpoint:
     """Test custom email sending endpoint."""
     
-    @patch('main.email_sender')
-    def test_send_custom_email_success(self, mock_email_sender, app, valid_custom_email):
+    def test_send_custom_email_success(self, email_deps, app, valid_custom_email):
         """Test successful custom email sending."""
         expected_result = {
             'email_sent': True,
             'to_email': 'recipient@example.com',
             'template_used': 'custom_notification',
-            'sent_at': datetime.now().isoformat()
+            'sent_at': _FIXED_TS
         }
-        mock_email_sender.send_templated_email.return_value = expected_result
+        email_deps.email.send_templated_email.return_value = expected_result
         
         response = app.post('/send-custom-email', json=valid_custom_email)
-        data = json.loads(response.data)
-        
-        assert response.status_code == 200
-        assert data['email_sent'] is True
-        assert data['to_email'] == 'recipient@example.com'
+        assert_subset(response, 200, email_sent=True, to_email='recipient@example.com')
         
-        mock_email_sender.send_templated_email.assert_called_once_with(
+        email_deps.email.send_templated_email.assert_called_once_with(
             to_email='recipient@example.com',
             subject='Test Custom Email',
             template_name='custom_notification',
             template_data=valid_custom_email['template_data'],
-            trace_id=unittest.mock.ANY
+            trace_id=ANY
         )
 
-    def test_send_custom_email_missing_fields(self, app):
-        """Test custom email with missing required fields."""
-        incomplete_request = {
-            'to_email': 'recipient@example.com'
-            # Missing subject
-        }
-        
-        response = app.post('/send-custom-email', json=incomplete_request)
-        data = json.loads(response.data)
-        
-        assert response.status_code == 400
-        assert 'campos requeridos' in data['error'].lower()
-
-    @patch('main.email_sender')
-    def test_send_custom_email_default_template(self, mock_email_sender, app):
+    def test_send_custom_email_default_template(self, email_deps, app):
         """Test custom email with default template name."""
         request_data = {
             'to_email': 'recipient@example.com',
@@ -343,25 +297,24 @@ class TestSendCustomEmailEndpoint:
             'email_sent': True,
             'template_used': 'custom'
         }
-        mock_email_sender.send_templated_email.return_value = expected_result
+        email_deps.email.send_templated_email.return_value = expected_result
         
         response = app.post('/send-custom-email', json=request_data)
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 200
         
-        mock_email_sender.send_templated_email.assert_called_once_with(
+        email_deps.email.send_templated_email.assert_called_once_with(
             to_email='recipient@example.com',
             subject='Test Email',
             template_name='custom',
             template_data={},
-            trace_id=unittest.mock.ANY
+            trace_id=ANY
         )
 
-    @patch('main.email_sender')
-    def test_send_custom_email_exception(self, mock_email_sender, app):
+    def test_send_custom_email_exception(self, email_deps, app):
         """Test custom email when exception occurs."""
-        mock_email_sender.send_templated_email.side_effect = Exception("Email sending failed")
+        email_deps.email.send_templated_email.side_effect = Exception("Email sending failed")
         
         request_data = {
             'to_email': 'recipient@example.com',
@@ -369,7 +322,7 @@ class TestSendCustomEmailEndpoint:
         }
         
         response = app.post('/send-custom-email', json=request_data)
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 500
         assert 'error' in data
@@ -378,67 +331,53 @@ class TestSendCustomEmailEndpoint:
 class TestTemplateEndpoints:
     """Test template management endpoints."""
     
-    @patch('main.template_manager')
-    def test_list_templates(self, mock_template_manager, app):
+    def test_list_templates(self, email_deps, app):
         """Test listing available templates."""
         expected_templates = ['completion', 'error', 'custom', 'notification']
-        mock_template_manager.get_available_templates.return_value = expected_templates
-        
-        response = app.get('/templates')
-        data = json.loads(response.data)
+        email_deps.template.get_available_templates.return_value = expected_templates
         
-        assert response.status_code == 200
-        assert data['templates'] == expected_templates
-        assert data['total_templates'] == 4
+        data = assert_subset(app.get('/templates'), 200, templates=expected_templates, total_templates=4)
         assert 'timestamp' in data
 
-    @patch('main.template_manager')
-    def test_list_templates_exception(self, mock_template_manager, app):
+    def test_list_templates_exception(self, email_deps, app):
         """Test listing templates when exception occurs."""
-        mock_template_manager.get_available_templates.side_effect = Exception("Template error")
+        email_deps.template.get_available_templates.side_effect = Exception("Template error")
         
         response = app.get('/templates')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 500
         assert 'error' in data
 
-    @patch('main.template_manager')
-    def test_get_template_info_success(self, mock_template_manager, app):
+    def test_get_template_info_success(self, email_deps, app):
         """Test getting specific template information."""
         template_info = {
             'name': 'completion',
             'description': 'Template for completion notifications',
             'variables': ['customer_name', 'signed_urls', 'expiration_time'],
-            'last_modified': datetime.now().isoformat()
+            'last_modified': _FIXED_TS
         }
-        mock_template_manager.get_template_info.return_value = template_info
-        
-        response = app.get('/templates/completion')
-        data = json.loads(response.data)
+        email_deps.template.get_template_info.return_value = template_info
         
-        assert response.status_code == 200
-        assert data['name'] == 'completion'
+        data = assert_subset(app.get('/templates/completion'), 200, name='completion')
         assert len(data['variables']) == 3
 
-    @patch('main.template_manager')
-    def test_get_template_info_not_found(self, mock_template_manager, app):
+    def test_get_template_info_not_found(self, email_deps, app):
         """Test getting template info for non-existent template."""
-        mock_template_manager.get_template_info.return_value = None
+        email_deps.template.get_template_info.return_value = None
         
         response = app.get('/templates/nonexistent')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 404
         assert 'no encontrado' in data['error']
 
-    @patch('main.template_manager')
-    def test_get_template_info_exception(self, mock_template_manager, app):
+    def test_get_template_info_exception(self, email_deps, app):
         """Test getting template info when exception occurs."""
-        mock_template_manager.get_template_info.side_effect = Exception("Template error")
+        email_deps.template.get_template_info.side_effect = Exception("Template error")
         
         response = app.get('/templates/completion')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 500
         assert 'error' in data
@@ -447,52 +386,43 @@ class TestTemplateEndpoints:
 class TestUtilityEndpoints:
     """Test utility endpoints like test email and statistics."""
     
-    @patch('main.email_sender')
-    @patch('main.config')
-    def test_test_email_success(self, mock_config, mock_email_sender, app):
+    def test_test_email_success(self, email_deps, app):
         """Test email configuration testing."""
-        mock_config.FROM_EMAIL = 'test@example.com'
+        email_deps.config.FROM_EMAIL = 'test@example.com'
         expected_result = {
             'test_email_sent': True,
             'to_email': 'test@example.com',
-            'sent_at': datetime.now().isoformat()
+            'sent_at': _FIXED_TS
         }
-        mock_email_sender.send_test_email.return_value = expected_result
-        
-        response = app.post('/test-email')
-        data = json.loads(response.data)
+        email_deps.email.send_test_email.return_value = expected_result
         
-        assert response.status_code == 200
-        assert data['test_email_sent'] is True
+        assert_subset(app.post('/test-email'), 200, test_email_sent=True)
 
-    @patch('main.email_sender')
-    def test_test_email_custom_recipient(self, mock_email_sender, app):
+    def test_test_email_custom_recipient(self, email_deps, app):
         """Test email configuration with custom recipient."""
         expected_result = {
             'test_email_sent': True,
             'to_email': 'custom@example.com'
         }
-        mock_email_sender.send_test_email.return_value = expected_result
+        email_deps.email.send_test_email.return_value = expected_result
         
         response = app.post('/test-email', json={'to_email': 'custom@example.com'})
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 200
-        mock_email_sender.send_test_email.assert_called_once_with('custom@example.com', unittest.mock.ANY)
+        email_deps.email.send_test_email.assert_called_once_with('custom@example.com', ANY)
 
-    @patch('main.email_sender')
-    def test_test_email_exception(self, mock_email_sender, app):
+    def test_test_email_exception(self, email_deps, app):
         """Test email configuration when exception occurs."""
-        mock_email_sender.send_test_email.side_effect = Exception("SMTP error")
+        email_deps.email.send_test_email.side_effect = Exception("SMTP error")
         
         response = app.post('/test-email')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 500
         assert 'error' in data
 
-    @patch('main.notification_manager')
-    def test_get_email_statistics_success(self, mock_notification, app):
+    def test_get_email_statistics_success(self, email_deps, app):
         """Test getting email statistics."""
         expected_stats = {
             'period_days': 7,
@@ -501,41 +431,34 @@ class TestUtilityEndpoints:
             'error_notifications': 25,
             'custom_emails': 5,
             'success_rate': 95.5,
-            'last_updated': datetime.now().isoformat()
+            'last_updated': _FIXED_TS
         }
-        mock_notification.get_email_statistics.return_value = expected_stats
-        
-        response = app.get('/statistics')
-        data = json.loads(response.data)
+        email_deps.notification.get_email_statistics.return_value = expected_stats
         
-        assert response.status_code == 200
-        assert data['total_emails_sent'] == 150
-        assert data['period_days'] == 7
+        assert_subset(app.get('/statistics'), 200, total_emails_sent=150, period_days=7)
         
-        mock_notification.get_email_statistics.assert_called_once_with(7)
+        email_deps.notification.get_email_statistics.assert_called_once_with(7)
 
-    @patch('main.notification_manager')
-    def test_get_email_statistics_custom_days(self, mock_notification, app):
+    def test_get_email_statistics_custom_days(self, email_deps, app):
         """Test getting email statistics with custom day range."""
         expected_stats = {
             'period_days': 30,
             'total_emails_sent': 500
         }
-        mock_notification.get_email_statistics.return_value = expected_stats
+        email_deps.notification.get_email_statistics.return_value = expected_stats
         
         response = app.get('/statistics?days=30')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 200
-        mock_notification.get_email_statistics.assert_called_once_with(30)
+        email_deps.notification.get_email_statistics.assert_called_once_with(30)
 
-    @patch('main.notification_manager')
-    def test_get_email_statistics_exception(self, mock_notification, app):
+    def test_get_email_statistics_exception(self, email_deps, app):
         """Test getting statistics when exception occurs."""
-        mock_notification.get_email_statistics.side_effect = Exception("Stats error")
+        email_deps.notification.get_email_statistics.side_effect = Exception("Stats error")
         
         response = app.get('/statistics')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 500
         assert 'error' in data
@@ -544,79 +467,39 @@ class TestUtilityEndpoints:
 class TestPubSubHandler:
     """Test Pub/Sub message handling endpoint."""
     
-    @patch('main.send_completion_email')
-    def test_pubsub_handler_completion_email(self, mock_send_completion, app):
+    def test_pubsub_handler_completion_email(self, mocker, email_main, app):
         """Test Pub/Sub handler for completion email action."""
-        message_data = {
-            'action': 'send_completion_email',
-            'processing_uuid': 'test-uuid-123'
-        }
-        
-        import base64
-        envelope = {
-            'message': {
-                'data': base64.b64encode(json.dumps(message_data).encode()).decode(),
-                'messageId': '123456789'
-            }
-        }
-        
+        mock_send_completion = mocker.patch.object(email_main, 'send_completion_email')
         mock_send_completion.return_value = ('{"success": true}', 200)
         
-        response = app.post('/pubsub-handler', json=envelope)
+        response = app.post('/pubsub-handler', json=_ENV_COMPLETION)
         
         assert response.status_code == 200
 
-    @patch('main.send_error_notification')
-    def test_pubsub_handler_error_notification(self, mock_send_error, app):
+    def test_pubsub_handler_error_notification(self, mocker, email_main, app):
         """Test Pub/Sub handler for error notification action."""
-        message_data = {
-            'action': 'send_error_notification',
-            'error_type': 'processing_failed'
-        }
-        
-        import base64
-        envelope = {
-            'message': {
-                'data': base64.b64encode(json.dumps(message_data).encode()).decode(),
-                'messageId': '123456789'
-            }
-        }
-        
+        mock_send_error = mocker.patch.object(email_main, 'send_error_notification')
         mock_send_error.return_value = ('{"success": true}', 200)
         
-        response = app.post('/pubsub-handler', json=envelope)
+        response = app.post('/pubsub-handler', json=_ENV_ERROR)
         
         assert response.status_code == 200
 
-    def test_pubsub_handler_unknown_action(self, app):
+    def test_pubsub_handler_unknown_action(self, email_main):
         """Test Pub/Sub handler with unknown action."""
-        message_data = {
-            'action': 'unknown_action'
-        }
-        
-        import base64
-        envelope = {
-            'message': {
-                'data': base64.b64encode(json.dumps(message_data).encode()).decode(),
-                'messageId': '123456789'
-            }
-        }
-        
-        response = app.post('/pubsub-handler', json=envelope)
-        data = json.loads(response.data)
+        data, status = call_view(email_main, 'handle_pubsub_message', _ENV_UNKNOWN)
         
-        assert response.status_code == 400
+        assert status == 400
         assert 'no reconocida' in data['error']
 
-    def test_pubsub_handler_invalid_message(self, app):
+    def test_pubsub_handler_invalid_message(self, email_main):
         """Test Pub/Sub handler with invalid message format."""
-        response = app.post('/pubsub-handler', json={})
-        data = json.loads(response.data)
+        data, status = call_view(email_main, 'handle_pubsub_message', {})
         
-        assert response.status_code == 400
+        assert status == 400
         assert 'error' in data
 
-    def test_pubsub_handler_exception(self, app):
+    def test_pubsub_handler_exception(self, email_main):
         """Test Pub/Sub handler when exception occurs."""
         # Invalid base64 data
         envelope = {
@@ -626,10 +509,9 @@ class TestPubSubHandler:
             }
         }
         
-        response = app.post('/pubsub-handler', json=envelope)
-        data = json.loads(response.data)
+        data, status = call_view(email_main, 'handle_pubsub_message', envelope)
         
-        assert response.status_code == 500
+        assert status == 500
         assert 'error' in data
 
 
@@ -637,13 +519,18 @@ class TestPubSubHandler:
 class TestEmailServiceIntegration:
     """Integration tests that test multiple components together."""
     
-    @patch('main.notification_manager')
-    @patch('main.template_manager')
-    @patch('main.email_sender')
-    def test_full_email_flow_completion(self, mock_email_sender, mock_template, mock_notification, app):
+    @pytest.fixture(scope="class", autouse=True)
+    def _integration_deps(self, request, email_main):
+        """Patch the collaborators once for the whole class."""
+        with patch.multiple(email_main, notification_manager=DEFAULT,
+                            template_manager=DEFAULT, email_sender=DEFAULT) as mocks:
+            request.cls.mocks = mocks
+            yield
+    
+    def test_full_email_flow_completion(self, app):
         """Test complete email sending flow for completion notification."""
         # Setup template manager
-        mock_template.get_available_templates.return_value = ['completion', 'error']
+        self.mocks['template_manager'].get_available_templates.return_value = ['completion', 'error']
         
         # Setup notification processing
         notification_result = {
@@ -652,7 +539,7 @@ class TestEmailServiceIntegration:
             'database_updated': True,
             'customer_email': 'customer@example.com'
         }
-        mock_notification.process_completion_notification.return_value = notification_result
+        self.mocks['notification_manager'].process_completion_notification.return_value = notification_result
         
         # Send completion email
         request_data = {
@@ -661,17 +548,11 @@ class TestEmailServiceIntegration:
             'signed_urls': ['https://signed-url.example.com/package.zip']
         }
         
-        response = app.post('/send-completion-email', json=request_data)
-        data = json.loads(response.data)
-        
-        assert response.status_code == 200
-        assert data['emails_sent'] == 1
+        assert_subset(app.post('/send-completion-email', json=request_data), 200, emails_sent=1)
         
         # Verify template was available
         templates_response = app.get('/templates')
-        templates_data = json.loads(templates_response.data)
+        templates_data = templates_response.get_json()
         
         assert templates_response.status_code == 200
         assert 'completion' in templates_data['templates']
-
-import unittest.mock
@@ -3,67 +3,70 @@ Unit tests for Image Processing Service.
 Tests all endpoints and core functionality for image processing.
 """
 import pytest
-import json
+import io
 import uuid
-from unittest.mock import Mock, patch, MagicMock
-from datetime import datetime, timedelta
-import sys
-import os
-
-# Add services to path for testing
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'services', 'image_processing_service', 'src'))
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'services', 'shared_utils', 'src'))
-
-# Mock shared services before import
-with patch.dict(sys.modules, {
-    'config': MagicMock(),
-    'logger': MagicMock(),
-    'storage_service': MagicMock(),
-    'database_service': MagicMock(),
-    'pubsub_service': MagicMock(),
-    'services.image_downloader': MagicMock(),
-    'services.zip_creator': MagicMock(),
-    'services.signed_url_generator': MagicMock(),
-    'services.cleanup_scheduler': MagicMock(),
-    'services.package_processor': MagicMock()
-}):
-    import main as image_main
-
-@pytest.fixture
-def app():
-    """Create Flask test app."""
+import zipfile
+import orjson
+from unittest.mock import ANY
+from datetime import datetime
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat
+from google.oauth2 import service_account
+
+# Timestamps for mocked results; tests never assert on their values
+_FAKE_NOW = datetime(2024, 1, 1)
+_FAKE_EXPIRATION = '2099-01-01T00:00:00'
+_FAKE_SCHEDULED_FOR = '2099-01-01T00:00:00'
+
+_VALID_PACKAGE_REQUEST = {
+    'processing_uuid': 'test-uuid-123',
+    'package_uri': 'gs://test-bucket/package_001.json',
+    'package_name': 'package_001.json'
+}
+# Request body serialized once; posted with data= to skip the test client's json.dumps
+_VALID_PACKAGE_BODY = orjson.dumps(_VALID_PACKAGE_REQUEST)
+# Only processing_uuid: missing package fields / default cleanup hours
+_UUID_ONLY_BODY = orjson.dumps({'processing_uuid': 'test-uuid-123'})
+_CLEANUP_BODY = orjson.dumps({'processing_uuid': 'test-uuid-123', 'cleanup_after_hours': 24})
+_EMPTY_BODY = orjson.dumps({})
+_INTEGRATION_PACKAGE_BODY = orjson.dumps({
+    'processing_uuid': 'integration-uuid-123',
+    'package_uri': 'gs://test-bucket/integration_package.json',
+    'package_name': 'integration_package.json'
+})
+_INTEGRATION_CLEANUP_BODY = orjson.dumps({
+    'processing_uuid': 'integration-uuid-123',
+    'cleanup_after_hours': 24
+})
+_STATUS_PACKAGE_BODY = orjson.dumps({
+    'processing_uuid': 'status-test-uuid',
+    'package_uri': 'gs://test-bucket/status_test.json',
+    'package_name': 'status_test.json'
+})
+
+@pytest.fixture(scope="session")
+def app(image_main):
+    """Create Flask test app (shared across the session; tests never mutate its config)."""
     image_main.app.config['TESTING'] = True
     return image_main.app.test_client()
 
 @pytest.fixture
-def valid_package_request():
-    """Valid package processing request."""
-    return {
-        'processing_uuid': 'test-uuid-123',
-        'package_uri': 'gs://test-bucket/package_001.json',
-        'package_name': 'package_001.json'
-    }
-
-@pytest.fixture
-def sample_package_data():
-    """Sample package data with shipment information."""
-    return {
-        'processing_uuid': 'test-uuid-123',
-        'package_name': 'package_001.json',
-        'shipments': [
-            {
-                'shipment_id': 'SHIP_001',
-                'customer': {
-                    'name': 'Test Customer',
-                    'email': 'test@example.com'
-                },
-                'images': [
-                    {'url': 'gs://images/ship1_img1.jpg', 'filename': 'front.jpg'},
-                    {'url': 'gs://images/ship1_img2.jpg', 'filename': 'back.jpg'}
-                ]
-            }
-        ]
-    }
+def adc_credentials(mocker, monkeypatch, image_main):
+    """Serve throwaway service-account credentials as ADC, with no signing key configured."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    credentials = service_account.Credentials.from_service_account_info({
+        'client_email': 'image-processing@test-project.iam.gserviceaccount.com',
+        'private_key': key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption()).decode(),
+        'token_uri': 'https://oauth2.googleapis.com/token',
+    })
+    mocker.patch.object(image_main.google.auth, 'default', return_value=(credentials, 'test-project'))
+    monkeypatch.delenv('SIGNING_SA_KEY_PATH', raising=False)
+    caches = (image_main.get_storage_client, image_main.get_bucket, image_main.get_signing_credentials)
+    for cached in caches:
+        cached.cache_clear()
+    yield credentials
+    for cached in caches:
+        cached.cache_clear()
 
 
 class TestHealthEndpoints:
@@ -72,50 +75,37 @@ class TestHealthEndpoints:
     def test_health_check(self, app):
         """Test health check endpoint returns healthy status."""
         response = app.get('/health')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 200
         assert data['status'] == 'healthy'
         assert data['service'] == 'image-processing-service'
         assert 'timestamp' in data
 
-    @patch('main.database_service')
-    @patch('main.storage_service')
-    def test_status_check_healthy(self, mock_storage, mock_db, app):
-        """Test status endpoint when all dependencies are healthy."""
-        mock_db.check_connectivity.return_value = True
-        mock_storage.check_bucket_access.return_value = True
+    @pytest.mark.parametrize("db_ok,storage_ok", [
+        (True, True),
+        (True, False),
+    ], ids=['healthy', 'unhealthy-storage'])
+    def test_status_check(self, image_deps, app, db_ok, storage_ok):
+        """Test status endpoint reports each dependency's health."""
+        image_deps.db.check_connectivity.return_value = db_ok
+        image_deps.storage.check_bucket_access.return_value = storage_ok
         
         response = app.get('/status')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 200
         assert data['status'] == 'ready'
-        assert data['dependencies']['database'] == 'healthy'
-        assert data['dependencies']['storage'] == 'healthy'
+        assert data['dependencies']['database'] == ('healthy' if db_ok else 'unhealthy')
+        assert data['dependencies']['storage'] == ('healthy' if storage_ok else 'unhealthy')
         assert data['service'] == 'image-processing-service'
 
-    @patch('main.database_service')
-    @patch('main.storage_service')
-    def test_status_check_unhealthy_storage(self, mock_storage, mock_db, app):
-        """Test status endpoint when storage is unhealthy."""
-        mock_db.check_connectivity.return_value = True
-        mock_storage.check_bucket_access.return_value = False
-        
-        response = app.get('/status')
-        data = json.loads(response.data)
-        
-        assert response.status_code == 200
-        assert data['dependencies']['storage'] == 'unhealthy'
-        assert data['dependencies']['database'] == 'healthy'
-
-    @patch('main.database_service')
-    def test_status_check_exception(self, mock_db, app):
+    def test_status_check_exception(self, image_deps, app):
         """Test status endpoint when exception occurs."""
-        mock_db.check_connectivity.side_effect = Exception("DB connection failed")
+        image_deps.db.check_connectivity.side_effect = Exception("DB connection failed")
         
         response = app.get('/status')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 500
         assert data['status'] == 'error'
@@ -125,8 +115,7 @@ class TestHealthEndpoints:
 class TestProcessPackageEndpoint:
     """Test the main package processing endpoint."""
     
-    @patch('main.package_processor')
-    def test_process_package_success(self, mock_processor, app, valid_package_request):
+    def test_process_package_success(self, image_deps, app):
         """Test successful package processing."""
         expected_result = {
             'processing_uuid': 'test-uuid-123',
@@ -135,12 +124,12 @@ class TestProcessPackageEndpoint:
             'zip_created': True,
             'signed_url_generated': True,
             'signed_url': 'https://signed-url.example.com/package.zip',
-            'expiration_time': (datetime.now() + timedelta(hours=2)).isoformat()
+            'expiration_time': _FAKE_EXPIRATION
         }
-        mock_processor.process_complete_package.return_value = expected_result
+        image_deps.processor.process_complete_package.return_value = expected_result
         
-        response = app.post('/process-package', json=valid_package_request)
-        data = json.loads(response.data)
+        response = app.post('/process-package', data=_VALID_PACKAGE_BODY, content_type='application/json')
+        data = response.get_json()
         
         assert response.status_code == 200
         assert data['processing_uuid'] == 'test-uuid-123'
@@ -149,58 +138,50 @@ class TestProcessPackageEndpoint:
         assert data['signed_url_generated'] is True
         
         # Verify method was called with correct arguments
-        mock_processor.process_complete_package.assert_called_once_with(
+        image_deps.processor.process_complete_package.assert_called_once_with(
             processing_uuid='test-uuid-123',
             package_uri='gs://test-bucket/package_001.json',
             package_name='package_001.json',
-            trace_id=unittest.mock.ANY
+            trace_id=ANY
         )
 
     def test_process_package_no_data(self, app):
         """Test processing with no request data."""
         response = app.post('/process-package')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 400
         assert 'error' in data
 
     def test_process_package_missing_fields(self, app):
         """Test processing with missing required fields."""
-        incomplete_request = {
-            'processing_uuid': 'test-uuid-123'
-            # Missing package_uri and package_name
-        }
-        
-        response = app.post('/process-package', json=incomplete_request)
-        data = json.loads(response.data)
+        # Missing package_uri and package_name
+        response = app.post('/process-package', data=_UUID_ONLY_BODY, content_type='application/json')
+        data = response.get_json()
         
         assert response.status_code == 400
         assert 'campos requeridos' in data['error'].lower()
 
-    @patch('main.package_processor')
-    @patch('main.pubsub_service')
-    def test_process_package_exception_with_pubsub(self, mock_pubsub, mock_processor, app, valid_package_request):
+    def test_process_package_exception_with_pubsub(self, image_deps, app):
         """Test exception handling with Pub/Sub error publishing."""
-        mock_processor.process_complete_package.side_effect = Exception("Processing failed")
+        image_deps.processor.process_complete_package.side_effect = Exception("Processing failed")
         
-        response = app.post('/process-package', json=valid_package_request)
-        data = json.loads(response.data)
+        response = app.post('/process-package', data=_VALID_PACKAGE_BODY, content_type='application/json')
+        data = response.get_json()
         
         assert response.status_code == 500
         assert 'error' in data
         
         # Verify error was published to Pub/Sub
-        mock_pubsub.publish_error.assert_called_once()
+        image_deps.pubsub.publish_error.assert_called_once()
 
-    @patch('main.package_processor')  
-    @patch('main.pubsub_service')
-    def test_process_package_pubsub_publish_fails(self, mock_pubsub, mock_processor, app, valid_package_request):
+    def test_process_package_pubsub_publish_fails(self, image_deps, app):
         """Test when Pub/Sub error publishing also fails."""
-        mock_processor.process_complete_package.side_effect = Exception("Processing failed")
-        mock_pubsub.publish_error.side_effect = Exception("Pub/Sub failed")
+        image_deps.processor.process_complete_package.side_effect = Exception("Processing failed")
+        image_deps.pubsub.publish_error.side_effect = Exception("Pub/Sub failed")
         
-        response = app.post('/process-package', json=valid_package_request)
-        data = json.loads(response.data)
+        response = app.post('/process-package', data=_VALID_PACKAGE_BODY, content_type='application/json')
+        data = response.get_json()
         
         assert response.status_code == 500
         assert 'error' in data
@@ -209,8 +190,7 @@ class TestProcessPackageEndpoint:
 class TestProcessingStatusEndpoint:
     """Test processing status lookup endpoint."""
     
-    @patch('main.database_service')
-    def test_get_processing_status_success(self, mock_db, app):
+    def test_get_processing_status_success(self, image_deps, app):
         """Test successful status retrieval."""
         mock_record = {
             'estado': 'completed',
@@ -219,16 +199,16 @@ class TestProcessingStatusEndpoint:
             'imagenes_procesadas': 15,
             'archivos_zip_creados': 3,
             'urls_firmadas_generadas': 3,
-            'fecha_inicio': datetime.now(),
-            'fecha_finalizacion': datetime.now(),
+            'fecha_inicio': _FAKE_NOW,
+            'fecha_finalizacion': _FAKE_NOW,
             'metadatos': {'packages': ['pkg1', 'pkg2', 'pkg3']},
             'resultado': {'signed_urls': ['url1', 'url2', 'url3']},
             'error_mensaje': None
         }
-        mock_db.get_image_processing_record.return_value = mock_record
+        image_deps.db.get_image_processing_record.return_value = mock_record
         
         response = app.get('/processing-status/test-uuid-123')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 200
         assert data['processing_uuid'] == 'test-uuid-123'
@@ -237,19 +217,17 @@ class TestProcessingStatusEndpoint:
         assert data['total_packages'] == 3
         assert data['images_processed'] == 15
 
-    @patch('main.database_service')
-    def test_get_processing_status_not_found(self, mock_db, app):
+    def test_get_processing_status_not_found(self, image_deps, app):
         """Test status retrieval for non-existent processing."""
-        mock_db.get_image_processing_record.return_value = None
+        image_deps.db.get_image_processing_record.return_value = None
         
         response = app.get('/processing-status/nonexistent-uuid')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 404
         assert 'no encontrado' in data['error']
 
-    @patch('main.database_service')
-    def test_get_processing_status_with_error(self, mock_db, app):
+    def test_get_processing_status_with_error(self, image_deps, app):
         """Test status retrieval when record has error message."""
         mock_record = {
             'estado': 'error',
@@ -258,160 +236,200 @@ class TestProcessingStatusEndpoint:
             'imagenes_procesadas': 5,
             'archivos_zip_creados': 1,
             'urls_firmadas_generadas': 1,
-            'fecha_inicio': datetime.now(),
+            'fecha_inicio': _FAKE_NOW,
             'fecha_finalizacion': None,
             'metadatos': {},
             'resultado': None,
             'error_mensaje': 'Image download failed'
         }
-        mock_db.get_image_processing_record.return_value = mock_record
+        image_deps.db.get_image_processing_record.return_value = mock_record
         
         response = app.get('/processing-status/error-uuid')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 200
         assert data['status'] == 'error'
         assert data['error_message'] == 'Image download failed'
 
-    @patch('main.database_service')
-    def test_get_processing_status_exception(self, mock_db, app):
-        """Test status retrieval when database exception occurs."""
-        mock_db.get_image_processing_record.side_effect = Exception("Database error")
-        
-        response = app.get('/processing-status/test-uuid')
-        data = json.loads(response.data)
-        
-        assert response.status_code == 500
-        assert 'error' in data
 
 
 class TestScheduleCleanupEndpoint:
     """Test cleanup scheduling endpoint."""
     
-    @patch('main.cleanup_scheduler')
-    def test_schedule_cleanup_success(self, mock_scheduler, app):
+    def test_schedule_cleanup_success(self, image_deps, app):
         """Test successful cleanup scheduling."""
         expected_result = {
             'processing_uuid': 'test-uuid-123',
             'cleanup_scheduled': True,
-            'scheduled_for': (datetime.now() + timedelta(hours=24)).isoformat(),
+            'scheduled_for': _FAKE_SCHEDULED_FOR,
             'cleanup_after_hours': 24
         }
-        mock_scheduler.schedule_cleanup.return_value = expected_result
+        image_deps.scheduler.schedule_cleanup.return_value = expected_result
         
-        request_data = {
-            'processing_uuid': 'test-uuid-123',
-            'cleanup_after_hours': 24
-        }
-        
-        response = app.post('/schedule-cleanup', json=request_data)
-        data = json.loads(response.data)
+        response = app.post('/schedule-cleanup', data=_CLEANUP_BODY, content_type='application/json')
+        data = response.get_json()
         
         assert response.status_code == 200
         assert data['cleanup_scheduled'] is True
         assert data['processing_uuid'] == 'test-uuid-123'
         
-        mock_scheduler.schedule_cleanup.assert_called_once_with(
+        image_deps.scheduler.schedule_cleanup.assert_called_once_with(
             processing_uuid='test-uuid-123',
             cleanup_after_hours=24,
-            trace_id=unittest.mock.ANY
+            trace_id=ANY
         )
 
     def test_schedule_cleanup_missing_uuid(self, app):
         """Test cleanup scheduling with missing processing_uuid."""
-        response = app.post('/schedule-cleanup', json={})
-        data = json.loads(response.data)
+        response = app.post('/schedule-cleanup', data=_EMPTY_BODY, content_type='application/json')
+        data = response.get_json()
         
         assert response.status_code == 400
         assert 'requerido' in data['error'].lower()
 
-    @patch('main.cleanup_scheduler')
-    @patch('main.config')
-    def test_schedule_cleanup_default_hours(self, mock_config, mock_scheduler, app):
+    def test_schedule_cleanup_default_hours(self, image_deps, app):
         """Test cleanup scheduling with default hours from config."""
-        mock_config.TEMP_FILES_CLEANUP_HOURS = 48
+        image_deps.config.TEMP_FILES_CLEANUP_HOURS = 48
         expected_result = {
             'processing_uuid': 'test-uuid-123',
             'cleanup_scheduled': True,
-            'scheduled_for': (datetime.now() + timedelta(hours=48)).isoformat(),
+            'scheduled_for': _FAKE_SCHEDULED_FOR,
             'cleanup_after_hours': 48
         }
-        mock_scheduler.schedule_cleanup.return_value = expected_result
-        
-        request_data = {'processing_uuid': 'test-uuid-123'}
+        image_deps.scheduler.schedule_cleanup.return_value = expected_result
         
-        response = app.post('/schedule-cleanup', json=request_data)
-        data = json.loads(response.data)
+        response = app.post('/schedule-cleanup', data=_UUID_ONLY_BODY, content_type='application/json')
+        data = response.get_json()
         
         assert response.status_code == 200
-        mock_scheduler.schedule_cleanup.assert_called_once_with(
+        image_deps.scheduler.schedule_cleanup.assert_called_once_with(
             processing_uuid='test-uuid-123',
             cleanup_after_hours=48,
-            trace_id=unittest.mock.ANY
+            trace_id=ANY
         )
 
-    @patch('main.cleanup_scheduler')
-    def test_schedule_cleanup_exception(self, mock_scheduler, app):
-        """Test cleanup scheduling when exception occurs."""
-        mock_scheduler.schedule_cleanup.side_effect = Exception("Scheduler error")
-        
-        request_data = {'processing_uuid': 'test-uuid-123'}
-        
-        response = app.post('/schedule-cleanup', json=request_data)
-        data = json.loads(response.data)
-        
-        assert response.status_code == 500
-        assert 'error' in data
 
 
 class TestExecuteCleanupEndpoint:
     """Test immediate cleanup execution endpoint."""
     
-    @patch('main.cleanup_scheduler')
-    def test_execute_cleanup_success(self, mock_scheduler, app):
+    def test_execute_cleanup_success(self, image_deps, app):
         """Test successful cleanup execution."""
         expected_result = {
             'processing_uuid': 'test-uuid-123',
             'cleanup_executed': True,
             'files_deleted': 15,
             'storage_freed_mb': 250.5,
-            'execution_time': datetime.now().isoformat()
+            'execution_time': _FAKE_NOW.isoformat()
         }
-        mock_scheduler.execute_cleanup_now.return_value = expected_result
+        image_deps.scheduler.execute_cleanup_now.return_value = expected_result
         
         response = app.post('/cleanup/execute/test-uuid-123')
-        data = json.loads(response.data)
+        data = response.get_json()
         
         assert response.status_code == 200
         assert data['cleanup_executed'] is True
         assert data['files_deleted'] == 15
         assert data['storage_freed_mb'] == 250.5
         
-        mock_scheduler.execute_cleanup_now.assert_called_once_with(
+        image_deps.scheduler.execute_cleanup_now.assert_called_once_with(
             processing_uuid='test-uuid-123',
-            trace_id=unittest.mock.ANY
+            trace_id=ANY
         )
 
-    @patch('main.cleanup_scheduler')
-    def test_execute_cleanup_exception(self, mock_scheduler, app):
-        """Test cleanup execution when exception occurs."""
-        mock_scheduler.execute_cleanup_now.side_effect = Exception("Cleanup failed")
-        
-        response = app.post('/cleanup/execute/test-uuid-123')
-        data = json.loads(response.data)
+
+class TestEndpointExceptions:
+    """Test endpoints return 500 when a collaborator raises."""
+    
+    @pytest.mark.parametrize("collaborator,method,http_method,url,kwargs", [
+        ('db', 'get_image_processing_record', 'get', '/processing-status/test-uuid', {}),
+        ('scheduler', 'schedule_cleanup', 'post', '/schedule-cleanup',
+         {'data': _UUID_ONLY_BODY, 'content_type': 'application/json'}),
+        ('scheduler', 'execute_cleanup_now', 'post', '/cleanup/execute/test-uuid-123', {}),
+    ], ids=['processing-status', 'schedule-cleanup', 'execute-cleanup'])
+    def test_endpoint_exception(self, image_deps, app, collaborator, method, http_method, url, kwargs):
+        """Test the endpoint reports an error when its collaborator fails."""
+        getattr(getattr(image_deps, collaborator), method).side_effect = Exception("Collaborator failed")
+        
+        response = getattr(app, http_method)(url, **kwargs)
+        data = response.get_json()
         
         assert response.status_code == 500
         assert 'error' in data
 
 
+class TestGcsHelpers:
+    """Test the GCS read/download/zip/upload helpers against the in-memory fake."""
+
+    def test_read_package_from_gcs(self, image_main, gcs_store):
+        gcs_store[('packages', 'package_001.json')] = orjson.dumps({'envios': []})
+
+        assert image_main.read_package_from_gcs('gs://packages/package_001.json') == {'envios': []}
+
+    def test_read_package_from_gcs_missing_returns_none(self, image_main, gcs_store):
+        assert image_main.read_package_from_gcs('gs://packages/missing.json') is None
+
+    def test_download_image_falls_back_to_png(self, image_main, gcs_store, tmp_path):
+        gcs_store[('images', 'ship1/front.png')] = b'png-bytes'
+
+        local_path = image_main.download_image(3, 'gs://images/ship1/front', str(tmp_path))
+
+        assert local_path == str(tmp_path / 'img_0003_front')
+        assert (tmp_path / 'img_0003_front').read_bytes() == b'png-bytes'
+
+    def test_download_images_skips_missing_and_keeps_order(self, image_main, gcs_store, tmp_path):
+        gcs_store[('images', 'a.jpg')] = b'a'
+        gcs_store[('images', 'c.jpg')] = b'c'
+        image_paths = ['gs://images/a.jpg', 'gs://images/missing', 'gs://images/c.jpg']
+
+        downloaded = image_main.download_images(image_paths, str(tmp_path))
+
+        assert downloaded == [str(tmp_path / 'img_0000_a.jpg'), str(tmp_path / 'img_0002_c.jpg')]
+
+    def test_create_zip_stores_compressed_formats(self, image_main, tmp_path):
+        photo = tmp_path / 'img_0000_front.jpg'
+        photo.write_bytes(b'jpeg-bytes')
+        manifest = tmp_path / 'img_0001_manifest'
+        manifest.write_bytes(b'plain text ' * 32)
+        zip_file = io.BytesIO()
+
+        image_main.create_zip([str(photo), str(manifest)], zip_file)
+
+        with zipfile.ZipFile(zip_file) as zipf:
+            compress_types = {info.filename: info.compress_type for info in zipf.infolist()}
+        assert compress_types == {
+            'img_0000_front.jpg': zipfile.ZIP_STORED,
+            'img_0001_manifest': zipfile.ZIP_DEFLATED,
+        }
+
+    def test_upload_to_gcs(self, image_main, gcs_store):
+        image_main.upload_to_gcs(io.BytesIO(b'zip-bytes'), 'processed', 'uuid/package.zip')
+
+        assert gcs_store[('processed', 'uuid/package.zip')] == b'zip-bytes'
+
+    @pytest.mark.parametrize("size,chunk_size", [(4, None), (5, 4)], ids=["single-request", "resumable"])
+    def test_upload_to_gcs_chunk_size(self, image_main, mocker, monkeypatch, size, chunk_size):
+        monkeypatch.setattr(image_main, 'UPLOAD_CHUNK_SIZE', 4)
+        blob = mocker.patch.object(image_main, 'get_bucket').return_value.blob.return_value
+        blob.chunk_size = None
+
+        image_main.upload_to_gcs(io.BytesIO(b'x' * size), 'processed', 'uuid/package.zip')
+
+        assert blob.chunk_size == chunk_size
+        blob.upload_from_file.assert_called_once_with(ANY, size=size, content_type='application/zip')
+
+    def test_generate_signed_url_without_signing_key(self, image_main, adc_credentials):
+        """Without SIGNING_SA_KEY_PATH the URL is signed with the client's ADC credentials."""
+        url = image_main.generate_signed_url('shipments-processed', 'uuid/package.zip')
+
+        assert url.startswith('https://storage.googleapis.com/shipments-processed/uuid/package.zip?')
+        assert 'X-Goog-Signature=' in url
+
 @pytest.mark.integration
 class TestImageProcessingServiceIntegration:
     """Integration tests that test multiple components together."""
     
-    @patch('main.package_processor')
-    @patch('main.cleanup_scheduler')
-    @patch('main.database_service')
-    def test_full_package_processing_with_cleanup_flow(self, mock_db, mock_scheduler, mock_processor, app):
+    def test_full_package_processing_with_cleanup_flow(self, image_deps, app):
         """Test complete package processing flow with cleanup scheduling."""
         # Setup package processing result
         processing_result = {
@@ -421,52 +439,39 @@ class TestImageProcessingServiceIntegration:
             'zip_created': True,
             'signed_url_generated': True,
             'signed_url': 'https://signed-url.example.com/package.zip',
-            'expiration_time': (datetime.now() + timedelta(hours=2)).isoformat()
+            'expiration_time': _FAKE_EXPIRATION
         }
-        mock_processor.process_complete_package.return_value = processing_result
+        image_deps.processor.process_complete_package.return_value = processing_result
         
         # Setup cleanup scheduling result
         cleanup_result = {
             'processing_uuid': 'integration-uuid-123',
             'cleanup_scheduled': True,
-            'scheduled_for': (datetime.now() + timedelta(hours=24)).isoformat(),
+            'scheduled_for': _FAKE_SCHEDULED_FOR,
             'cleanup_after_hours': 24
         }
-        mock_scheduler.schedule_cleanup.return_value = cleanup_result
+        image_deps.scheduler.schedule_cleanup.return_value = cleanup_result
         
         # Process package
-        package_request = {
-            'processing_uuid': 'integration-uuid-123',
-            'package_uri': 'gs://test-bucket/integration_package.json',
-            'package_name': 'integration_package.json'
-        }
-        
-        response1 = app.post('/process-package', json=package_request)
-        data1 = json.loads(response1.data)
+        response1 = app.post('/process-package', data=_INTEGRATION_PACKAGE_BODY, content_type='application/json')
+        data1 = response1.get_json()
         
         assert response1.status_code == 200
         assert data1['images_processed'] == 8
         assert data1['zip_created'] is True
         
         # Schedule cleanup
-        cleanup_request = {
-            'processing_uuid': 'integration-uuid-123',
-            'cleanup_after_hours': 24
-        }
-        
-        response2 = app.post('/schedule-cleanup', json=cleanup_request)
-        data2 = json.loads(response2.data)
+        response2 = app.post('/schedule-cleanup', data=_INTEGRATION_CLEANUP_BODY, content_type='application/json')
+        data2 = response2.get_json()
         
         assert response2.status_code == 200
         assert data2['cleanup_scheduled'] is True
         
         # Verify both services were called correctly
-        mock_processor.process_complete_package.assert_called_once()
-        mock_scheduler.schedule_cleanup.assert_called_once()
+        image_deps.processor.process_complete_package.assert_called_once()
+        image_deps.scheduler.schedule_cleanup.assert_called_once()
 
-    @patch('main.package_processor')
-    @patch('main.database_service')
-    def test_package_processing_with_status_check(self, mock_db, mock_processor, app):
+    def test_package_processing_with_status_check(self, image_deps, app):
         """Test package processing followed by status check."""
         processing_uuid = 'status-test-uuid'
         
@@ -478,7 +483,7 @@ class TestImageProcessingServiceIntegration:
             'zip_created': True,
             'signed_url_generated': True
         }
-        mock_processor.process_complete_package.return_value = processing_result
+        image_deps.processor.process_complete_package.return_value = processing_result
         
         # Setup database record for status check
         db_record = {
@@ -488,31 +493,23 @@ class TestImageProcessingServiceIntegration:
             'imagenes_procesadas': 3,
             'archivos_zip_creados': 1,
             'urls_firmadas_generadas': 1,
-            'fecha_inicio': datetime.now(),
-            'fecha_finalizacion': datetime.now(),
+            'fecha_inicio': _FAKE_NOW,
+            'fecha_finalizacion': _FAKE_NOW,
             'metadatos': {'package': 'status_test.json'},
             'resultado': processing_result,
             'error_mensaje': None
         }
-        mock_db.get_image_processing_record.return_value = db_record
+        image_deps.db.get_image_processing_record.return_value = db_record
         
         # Process package
-        package_request = {
-            'processing_uuid': processing_uuid,
-            'package_uri': 'gs://test-bucket/status_test.json',
-            'package_name': 'status_test.json'
-        }
-        
-        response1 = app.post('/process-package', json=package_request)
+        response1 = app.post('/process-package', data=_STATUS_PACKAGE_BODY, content_type='application/json')
         assert response1.status_code == 200
         
         # Check status
         response2 = app.get(f'/processing-status/{processing_uuid}')
-        data2 = json.loads(response2.data)
+        data2 = response2.get_json()
         
         assert response2.status_code == 200
         assert data2['processing_uuid'] == processing_uuid
         assert data2['status'] == 'completed'
         assert data2['images_processed'] == 3
-
-import unittest.mock